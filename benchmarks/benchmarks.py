@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmarks of the overhead of Layer and Stack, to be run with asv
+(https://asv.readthedocs.io), e.g. `asv run` or `asv continuous master HEAD`.
+
+The models are cheap linear models, so the time and memory measured are
+mostly the ones of stacking itself and not of the underlying models.
+time_* benchmarks record the wall time and peakmem_* the peak memory."""
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.linear_model import Ridge
+from sklearn.model_selection import KFold
+from sklearn.preprocessing import MaxAbsScaler
+
+from picknmix import Layer, Stack
+
+N_FEATURES = 20
+
+
+def make_data(n_samples, sparse):
+    rng = np.random.RandomState(0)
+    if sparse:
+        X = sp.random(n_samples, N_FEATURES, density=0.1, format='csr',
+                      random_state=rng)
+    else:
+        X = rng.rand(n_samples, N_FEATURES)
+    y = np.asarray(X @ rng.rand(N_FEATURES)).ravel()
+    return X, y
+
+
+def make_layer(width):
+    return Layer([Ridge(alpha=alpha) for alpha in np.linspace(0.1, 1, width)],
+                 [MaxAbsScaler() if idx % 2 else None
+                  for idx in range(width)])
+
+
+def make_stack(depth, width, folds=False):
+    layers = [make_layer(width) for _ in range(depth - 1)]
+    layers.append(make_layer(1))
+    return Stack(layers, folds=KFold(depth) if folds else None)
+
+
+class LayerSuite:
+    params = ([1, 4, 16], [1000, 100000], [False, True])
+    param_names = ['width', 'n_samples', 'sparse']
+
+    def setup(self, width, n_samples, sparse):
+        self.X, self.y = make_data(n_samples, sparse)
+        self.layer = make_layer(width)
+        self.fitted_layer = make_layer(width)
+        self.fitted_layer.fit(self.X, self.y)
+
+    def time_fit(self, width, n_samples, sparse):
+        self.layer.fit(self.X, self.y)
+
+    def peakmem_fit(self, width, n_samples, sparse):
+        self.layer.fit(self.X, self.y)
+
+    def time_predict(self, width, n_samples, sparse):
+        self.fitted_layer.predict(self.X)
+
+    def peakmem_predict(self, width, n_samples, sparse):
+        self.fitted_layer.predict(self.X)
+
+    def time_copy(self, width, n_samples, sparse):
+        self.fitted_layer.copy()
+
+
+class StackSuite:
+    params = ([2, 4], [4], [1000, 100000], [False, True], [False, True])
+    param_names = ['depth', 'width', 'n_samples', 'sparse', 'folds']
+
+    def setup(self, depth, width, n_samples, sparse, folds):
+        self.X, self.y = make_data(n_samples, sparse)
+        self.stack = make_stack(depth, width, folds)
+        self.fitted_stack = make_stack(depth, width, folds)
+        self.fitted_stack.fit(self.X, self.y)
+
+    def time_fit(self, depth, width, n_samples, sparse, folds):
+        self.stack.fit(self.X, self.y)
+
+    def peakmem_fit(self, depth, width, n_samples, sparse, folds):
+        self.stack.fit(self.X, self.y)
+
+    def time_predict(self, depth, width, n_samples, sparse, folds):
+        self.fitted_stack.predict(self.X)
+
+    def peakmem_predict(self, depth, width, n_samples, sparse, folds):
+        self.fitted_stack.predict(self.X)
+
+    def time_copy(self, depth, width, n_samples, sparse, folds):
+        self.fitted_stack.copy()
+
+
+class StackSingleRowSuite:
+    """Latency of predicting one row, dominated by the stacking overhead"""
+    params = ([2, 4], [1, 4, 16])
+    param_names = ['depth', 'width']
+
+    def setup(self, depth, width):
+        X, y = make_data(1000, False)
+        self.row = X[:1]
+        self.stack = make_stack(depth, width)
+        self.stack.fit(X, y)
+
+    def time_predict(self, depth, width):
+        self.stack.predict(self.row)
@@ -2,7 +2,12 @@
 
 """Top-level package for Pick n Mix."""
 
-from .picknmix import Layer, Stack
+from .picknmix import Layer, Stack, CompiledStack
+from .cache import MemberCache, RowPredictionCache
+from .instrument import JSONLinesLogger, ReportCollector
+from .serving import MicroBatcher
+from .distributed import LocalCluster
+from .search import StackSearch
 
 __author__ = """Cheuk Ting Ho"""
 __email__ = 'cheukting.ho@gmail.com'
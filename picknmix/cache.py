@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+
+"""Caches used by Pick n Mix to avoid recomputing the same predictions."""
+
+import os
+import time
+import shutil
+import pickle
+import hashlib
+import tempfile
+import warnings
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class LayerOutputCache:
+    def __init__(self, directory=None):
+        """Cache of the predictions of the Layers of a Stack on its
+        training data, keyed by (layer index, fold index), where the fold
+        index is None for all the training data.
+
+        Parameters
+        ==========
+        directory : str or None
+            If None (default) the predictions are kept in memory. Otherwise
+            they are spilled to .npy files in a temporary directory inside
+            directory and memory mapped back when used.
+        """
+        self.directory = directory
+        self.token = None
+        self._entries = {}
+        self._spill_dir = None
+
+    def __getstate__(self):
+        # cached predictions are not worth pickling
+        state = self.__dict__.copy()
+        state['token'] = None
+        state['_entries'] = {}
+        state['_spill_dir'] = None
+        return state
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def reset(self, token):
+        """Clear the cache if token, identifying the training data, is not
+        the same as the one the cache was filled with"""
+        if token != self.token:
+            self.clear()
+            self.token = token
+
+    def get(self, key):
+        """Return the cached predictions of key, or None if not cached"""
+        return self._entries.get(key)
+
+    def put(self, key, value):
+        """Cache value under key and return it, as a read-only memory map if
+        the cache spills to disk"""
+        if self.directory is not None and isinstance(value, np.ndarray):
+            if self._spill_dir is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._spill_dir = tempfile.mkdtemp(prefix='picknmix-',
+                                                   dir=self.directory)
+            layer_idx, fold_idx = key
+            path = os.path.join(self._spill_dir, 'layer{}_fold{}.npy'.format(
+                layer_idx, 'all' if fold_idx is None else fold_idx))
+            np.save(path, value)
+            value = np.load(path, mmap_mode='r')
+        self._entries[key] = value
+        return value
+
+    def fork(self):
+        """A new cache with the same predictions, which can then be changed
+        independently of this one"""
+        cache = LayerOutputCache(self.directory)
+        cache.token = self.token
+        cache._entries = dict(self._entries)
+        return cache
+
+    def invalidate(self, from_layer):
+        """Remove the predictions of all Layers from from_layer onwards,
+        e.g. when they are fitted again"""
+        for key in [key for key in self._entries if key[0] >= from_layer]:
+            del self._entries[key]
+
+    def clear(self):
+        """Remove everything from the cache, including spilled files"""
+        self._entries = {}
+        if self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+
+
+class MemberCache:
+    def __init__(self, directory, max_bytes=None):
+        """Persistent cache of fitted Layer members, used by Layer.fit to
+        reload a preprocessor and model pair, with its predictions, instead
+        of fitting it again. The entries are content addressed: the key is a
+        hash of the class and parameters of the preprocessor and the model,
+        the proba option and the training data.
+
+        Parameters
+        ==========
+        directory : str
+            Directory of the cache, created if it does not exist. It can be
+            shared between Layers, Stacks and runs.
+        max_bytes : int or None
+            Maximum size of the cache on disk, the least recently used
+            entries are evicted when it is exceeded. None (default) means
+            no limit.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def data_key(self, X, y):
+        """Fingerprint of the training data (X, y)"""
+        digest = hashlib.sha256()
+        for data in (X, y):
+            _update_digest(digest, data)
+        return digest.hexdigest()
+
+    def member_key(self, preprocessor, model, proba, data_key):
+        """Key of a preprocessor and model pair, unfitted, trained on the data
+        with fingerprint data_key, or None if the pair cannot be cached
+        because its parameters cannot be hashed"""
+        fingerprints = (_estimator_fingerprint(preprocessor),
+                        _estimator_fingerprint(model))
+        if None in fingerprints:
+            return None
+        digest = hashlib.sha256()
+        for part in fingerprints + (repr(proba), data_key):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def load(self, key):
+        """Return the (preprocessor, model, predictions) cached under key, or
+        None if not cached"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                member = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        # mark as recently used
+        os.utime(path)
+        return member
+
+    def store(self, key, member):
+        """Cache member, a (preprocessor, model, predictions) tuple, under key
+        and evict the least recently used entries if needed. A member which
+        cannot be pickled (e.g. holding a lambda) is not cached, with a
+        warning."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(member, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except (pickle.PicklingError, TypeError, AttributeError,
+                OSError) as exc:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            warnings.warn("The member could not be cached: {}".format(exc))
+            return
+        if self.max_bytes is not None:
+            self._evict()
+
+    def size(self):
+        """Total size of the entries on disk, in bytes"""
+        return sum(size for _, _, size in self._entries())
+
+    def clear(self):
+        """Remove every entry of the cache"""
+        for path, _, _ in self._entries():
+            os.remove(path)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+
+class RowPredictionCache:
+    def __init__(self, max_size=10000, ttl=None):
+        """Cache of the predictions of a Stack by input row, so rows seen
+        recently are not predicted again, see the row_cache option of Stack.
+        The rows are keyed by their data type and bytes, so only dense
+        data is cached, arrays of objects being cast to float64 first.
+
+        Parameters
+        ==========
+        max_size : int
+            Maximum number of rows cached, the least recently used rows are
+            evicted first.
+        ttl : float or None
+            If given, the predictions expire this many seconds after being
+            cached.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        # number of rows found in and missing from the cache
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_entries'] = OrderedDict()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def keys(self, X):
+        """The key of each row of X: its bytes, prefixed with the data type
+        of X, so e.g. large integers are not rounded to the same float"""
+        if hasattr(X, 'to_numpy'):
+            X = X.to_numpy()
+        X = np.asarray(X)
+        if X.dtype.hasobject:
+            # the bytes of objects are their addresses
+            X = X.astype(np.float64)
+        X = np.ascontiguousarray(X)
+        prefix = X.dtype.str.encode('ascii')
+        return [prefix + row.tobytes() for row in X]
+
+    def get_many(self, keys):
+        """The cached prediction of each key, None for the missing ones"""
+        now = time.monotonic()
+        values = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] is not None and \
+                        entry[1] < now:
+                    del self._entries[key]
+                    entry = None
+                if entry is None:
+                    self.misses += 1
+                    values.append(None)
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    values.append(entry[0])
+        return values
+
+    def put_many(self, keys, values):
+        """Cache the prediction of each key"""
+        expiry = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            for key, value in zip(keys, values):
+                self._entries[key] = (value, expiry)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove every prediction, e.g. when the Stack is fitted again"""
+        with self._lock:
+            self._entries = OrderedDict()
+
+
+def _estimator_fingerprint(estimator):
+    """Hash of the class and parameters of estimator, arrays included, or
+    None if they cannot be hashed reliably (e.g. a lambda), the estimator
+    is then equivalent to no other"""
+    digest = hashlib.sha256()
+    try:
+        _update_param_digest(digest, estimator)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return None
+    return digest.hexdigest()
+
+
+def _update_param_digest(digest, value):
+    if value is None or isinstance(value, (bool, int, float, complex, str,
+                                           bytes, np.generic)):
+        text = '{}:{!r}\0'.format(type(value).__name__, value)
+        digest.update(text.encode('utf-8'))
+    elif isinstance(value, (list, tuple)):
+        text = '{}:{}\0'.format(type(value).__name__, len(value))
+        digest.update(text.encode('utf-8'))
+        for item in value:
+            _update_param_digest(digest, item)
+    elif isinstance(value, dict):
+        digest.update('dict:{}\0'.format(len(value)).encode('utf-8'))
+        for key in sorted(value, key=repr):
+            _update_param_digest(digest, key)
+            _update_param_digest(digest, value[key])
+    elif hasattr(value, 'get_params') and not isinstance(value, type):
+        cls = type(value)
+        text = '{}.{}\0'.format(cls.__module__, cls.__qualname__)
+        digest.update(text.encode('utf-8'))
+        _update_param_digest(digest, value.get_params(deep=False))
+    elif isinstance(value, np.ndarray) or hasattr(value, 'tocsr') or \
+            hasattr(value, 'to_numpy'):
+        # repr shortens large arrays, their bytes are hashed instead
+        _update_digest(digest, value)
+    else:
+        digest.update(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def _update_digest(digest, data):
+    if hasattr(data, 'tocsr'):
+        data = data.tocsr()
+        digest.update(repr(data.shape).encode('utf-8'))
+        for array in (data.data, data.indices, data.indptr):
+            _update_digest(digest, array)
+        return
+    if hasattr(data, 'to_numpy'):
+        data = data.to_numpy()
+    data = np.asarray(data)
+    digest.update('{}{}'.format(data.dtype, data.shape).encode('utf-8'))
+    if data.dtype.hasobject:
+        digest.update(pickle.dumps(data))
+    else:
+        digest.update(np.ascontiguousarray(data).data)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+"""Exit criteria for Stack.predict_cascade.
+
+A criterion is a callable taking a fitted Layer and its predictions for
+the next Layer, and returning a boolean array of the rows decided by the
+Layer, which exit the cascade, along with the final predictions of those
+rows."""
+
+import numpy as np
+
+
+class ProbaThreshold:
+    def __init__(self, threshold, member=None):
+        """Exit criterion for classification: the rows whose most probable
+        class has a probability of at least threshold exit the cascade,
+        predicted as this class.
+
+        Parameters
+        ==========
+        threshold : float
+            Minimum probability of the most probable class, e.g. 0.9.
+        member : int or None
+            Index of the model of the Layer whose probabilities are used.
+            If None (default), the probabilities of all the models of the
+            Layer predicting them (with proba) are averaged.
+        """
+        self.threshold = threshold
+        self.member = member
+
+    def __call__(self, layer, predictions):
+        if self.member is not None:
+            members = [self.member]
+        else:
+            members = [idx for idx, method in enumerate(layer.predict_methods)
+                       if method == 'predict_proba']
+        if not members or any(layer.predict_methods[idx] != 'predict_proba'
+                              for idx in members):
+            raise ValueError("ProbaThreshold needs models predicting "
+                             "probabilities, see the proba option of Layer")
+        if layer.passthrough:
+            # the features passed through are the first columns
+            predictions = predictions[:, layer.n_features_in:]
+        if hasattr(predictions, 'toarray'):
+            predictions = predictions.toarray()
+        slices = layer._output_slices()
+        proba = np.mean([predictions[:, slices[idx][0]:slices[idx][1]]
+                         for idx in members], axis=0)
+        # models fitted on each fold only when fit_oof did not refit
+        fitted = layer.fold_layers[0] if layer.fold_layers else layer
+        classes = fitted.models[members[0]].classes_
+        confident = proba.max(axis=1) >= self.threshold
+        return confident, classes[proba[confident].argmax(axis=1)]
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+"""Running the fit of a Stack on a cluster of workers.
+
+Stack.fit and Layer.fit accept an executor, any object with the two
+methods of a dask.distributed.Client:
+
+scatter(data)
+    Send data to the workers and return a reference to it, which is
+    replaced by the data when given as an argument to submit. Scattering
+    the same object again should not send it again.
+submit(func, *args)
+    Run func(*args) on a worker and return a future, with a result method.
+
+The work of a Layer is a task per (member, fold), all depending on the same
+data, the predictions of the previous Layer, which is scattered once and
+shared by the tasks instead of being sent with each of them.
+LocalCluster implements the interface with processes on one machine, a
+dask.distributed.Client can be used as it is."""
+
+import os
+import pickle
+import hashlib
+import shutil
+import weakref
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from .parallel import effective_n_jobs
+from .cache import _update_digest
+
+# data loaded by a worker process, by path, the most recent last
+_worker_data = OrderedDict()
+WORKER_DATA_SIZE = 4
+
+
+def submit_tasks(executor, func, tasks):
+    """Submit func(*task) for each task in tasks to executor, all at once,
+    and return the results in the same order as tasks"""
+    futures = [executor.submit(func, *task) for task in tasks]
+    return [future.result() for future in futures]
+
+
+class DataRef:
+    def __init__(self, path, kind):
+        """Reference to data scattered by a LocalCluster, stored in the file
+        path, as an .npy file (kind 'npy') or a pickle (kind 'pkl')"""
+        self.path = path
+        self.kind = kind
+
+    def __repr__(self):
+        return 'DataRef({!r})'.format(self.path)
+
+    def load(self):
+        """The data, loaded once per worker process. Arrays are memory
+        mapped read-only, so the workers share one copy of them."""
+        if self.path in _worker_data:
+            _worker_data.move_to_end(self.path)
+            return _worker_data[self.path]
+        if self.kind == 'npy':
+            data = np.load(self.path, mmap_mode='r')
+        else:
+            with open(self.path, 'rb') as f:
+                data = pickle.load(f)
+        _worker_data[self.path] = data
+        while len(_worker_data) > WORKER_DATA_SIZE:
+            _worker_data.popitem(last=False)
+        return data
+
+
+class LocalCluster:
+    def __init__(self, n_workers=None, directory=None):
+        """A pool of worker processes on this machine, with the interface of
+        a cluster (scatter and submit), to fit a Stack on.
+        Scattered data is written once to a file, which the workers memory
+        map (arrays) or load (anything else) the first time they use it.
+
+        Parameters
+        ==========
+        n_workers : int or None
+            Number of processes, see parallel.effective_n_jobs. None means
+            one per processor.
+        directory : str or None
+            Where the scattered data is written, the temporary directory of
+            the system if None.
+        """
+        self.n_workers = effective_n_jobs(-1 if n_workers is None
+                                          else n_workers)
+        self._executor = ProcessPoolExecutor(max_workers=self.n_workers)
+        self._directory = tempfile.mkdtemp(prefix='picknmix-cluster-',
+                                           dir=directory)
+        # fingerprint of the content and reference of the objects scattered,
+        # by id, while they exist
+        self._scattered = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def scatter(self, data):
+        """Write data for the workers and return its DataRef. Scattering the
+        same object again, with the same content, returns the same DataRef
+        as long as the object exists (if it can be weakly referenced, e.g.
+        arrays). An object modified in place is written again."""
+        with self._lock:
+            fingerprint = _fingerprint(data)
+            if id(data) in self._scattered:
+                scattered_fingerprint, ref = self._scattered[id(data)]
+                if scattered_fingerprint == fingerprint:
+                    return ref
+            self._count += 1
+            path = os.path.join(self._directory, str(self._count))
+            if isinstance(data, np.ndarray) and not data.dtype.hasobject:
+                ref = DataRef(path + '.npy', 'npy')
+                np.save(ref.path, data)
+            else:
+                ref = DataRef(path + '.pkl', 'pkl')
+                with open(ref.path, 'wb') as f:
+                    pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            try:
+                weakref.finalize(data, self._release, id(data), ref.path)
+            except TypeError:
+                # not weakly referenceable, scattered again next time
+                pass
+            else:
+                self._scattered[id(data)] = (fingerprint, ref)
+            return ref
+
+    def submit(self, func, *args):
+        """Run func(*args) in a worker process, with the DataRefs in args
+        replaced by their data, and return a concurrent.futures.Future"""
+        return self._executor.submit(_run_task, func, args)
+
+    def close(self):
+        """Stop the workers and remove the scattered data"""
+        self._executor.shutdown(wait=True)
+        self._scattered = {}
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    def _release(self, data_id, path):
+        with self._lock:
+            self._scattered.pop(data_id, None)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _fingerprint(data):
+    """Hash of the content of data, None if it cannot be hashed"""
+    digest = hashlib.sha256()
+    try:
+        _update_digest(digest, data)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return None
+    return digest.hexdigest()
+
+
+def _run_task(func, args):
+    return func(*[arg.load() if isinstance(arg, DataRef) else arg
+                  for arg in args])
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+"""Callbacks for the reports of Layer and Stack, to pass as `callbacks`.
+A callback is any callable taking the report dict, e.g. to export the
+timings to Prometheus or StatsD."""
+
+import json
+import threading
+
+
+class JSONLinesLogger:
+    def __init__(self, path):
+        """Append every report to a file as one line of JSON
+
+        Parameters
+        ==========
+        path : str
+            The file to append to, created if it does not exist.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __call__(self, report):
+        line = json.dumps(report, default=str)
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+
+
+class ReportCollector:
+    def __init__(self):
+        """Keep every report in the list ReportCollector.reports"""
+        self.reports = []
+
+    def __call__(self, report):
+        self.reports.append(report)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+"""Helpers for running the independent pieces of work inside Pick n Mix
+(e.g. the members of a Layer) concurrently.
+
+Three backends are supported:
+'threading' (default) uses a pool of threads, which works well for
+estimators that release the GIL (most of numpy and scikit-learn);
+'multiprocessing' uses a pool of processes, the work and its results are
+pickled to and from the workers;
+'joblib' hands the work to joblib, so any joblib backend configured with
+`joblib.parallel_backend` is used."""
+
+import os
+import importlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+BACKENDS = ('threading', 'multiprocessing', 'joblib')
+
+
+def check_backend(backend):
+    """Raise a ValueError if backend is not one of the supported BACKENDS"""
+    if backend not in BACKENDS:
+        raise ValueError("Unknown backend {}, expected one of {}".format(
+            backend, BACKENDS))
+    return backend
+
+
+def effective_n_jobs(n_jobs, n_tasks=None):
+    """Number of workers to use for n_jobs, follow the convention of
+    scikit-learn: None means 1, -1 means using all processors and
+    -2 means all processors but one, etc.
+
+    Parameters
+    ==========
+    n_jobs : int or None
+    n_tasks : int, optional
+        If given, the number of workers never exceed the number of tasks.
+    """
+    if n_jobs is None or n_jobs == 0:
+        n_jobs = 1
+    elif n_jobs < 0:
+        n_jobs = max((os.cpu_count() or 1) + 1 + n_jobs, 1)
+    if n_tasks is not None:
+        n_jobs = max(min(n_jobs, n_tasks), 1)
+    return n_jobs
+
+
+def parallel_map(func, tasks, n_jobs=None, backend='threading'):
+    """Call func(*task) for each task in tasks and return the results in
+    the same order as tasks, regardless of the order they finished.
+
+    Parameters
+    ==========
+    func : callable
+        Must be picklable (i.e. defined at module level) for the
+        'multiprocessing' and 'joblib' backends.
+    tasks : iterable of tuples
+        Positional arguments of each call.
+    n_jobs : int or None
+        Number of workers, see effective_n_jobs.
+    backend : str
+        One of BACKENDS.
+
+    Returns
+    =======
+    results : list
+    """
+    check_backend(backend)
+    tasks = list(tasks)
+    n_jobs = effective_n_jobs(n_jobs, len(tasks))
+    if n_jobs == 1:
+        return [func(*task) for task in tasks]
+
+    if backend == 'joblib':
+        joblib = importlib.import_module('joblib')
+        return joblib.Parallel(n_jobs=n_jobs)(
+            joblib.delayed(func)(*task) for task in tasks)
+
+    if backend == 'threading':
+        executor_class = ThreadPoolExecutor
+    else:
+        executor_class = ProcessPoolExecutor
+    with executor_class(max_workers=n_jobs) as executor:
+        return executor_map(executor, func, tasks)
+
+
+def executor_map(executor, func, tasks):
+    """Same as parallel_map but run on an existing executor (anything with
+    a `submit` method returning futures, e.g. a ThreadPoolExecutor), so the
+    workers are reused between calls.
+    The last task is run in the calling thread while waiting for the others.
+    """
+    tasks = list(tasks)
+    if len(tasks) <= 1:
+        return [func(*task) for task in tasks]
+    futures = [executor.submit(func, *task) for task in tasks[:-1]]
+    last_result = func(*tasks[-1])
+    return [future.result() for future in futures] + [last_result]
+
+
+def shares_memory(executor):
+    """Whether the tasks run on executor share the memory of the caller,
+    i.e. can write their results into its arrays: True for a pool of
+    threads (or None, the threads of parallel_map or of an event loop),
+    False for any other executor, e.g. a pool of processes"""
+    return executor is None or isinstance(executor, ThreadPoolExecutor)
+
+
+def make_pool(n_jobs=None):
+    """Create a persistent pool of threads with effective_n_jobs(n_jobs)
+    workers, to be shared by the Layers predicting online"""
+    return ThreadPoolExecutor(max_workers=effective_n_jobs(n_jobs))
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+"""Saving and loading fitted Layers and Stacks.
+
+A saved model is a directory holding a manifest.json, a pickle of the
+Layer or Stack without its models and preprocessors (the skeleton), and
+one pickle per model and preprocessor. The large NumPy arrays of the
+pickles (e.g. coefficients, trees, support vectors) are stored raw next to
+them, out of band, so loading memory maps them instead of reading them:
+the workers of a server loading the same model share its arrays read-only
+in the page cache, and start quickly.
+Loading can also be lazy: the models and preprocessors are then LazyMember
+handles, only read when they are first used."""
+
+import os
+import json
+import pickle
+import copyreg
+import shutil
+import tempfile
+import threading
+import numpy as np
+
+FORMAT = 'picknmix'
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+# arrays smaller than this are kept inside the pickles
+MIN_BUFFER_BYTES = 1 << 16
+
+
+def save(obj, path, min_buffer_bytes=MIN_BUFFER_BYTES):
+    """Save a Layer or Stack to the directory path, replaced if it is a
+    previously saved model. The directory is written next to path then
+    renamed, so readers never see a partly written model. The callbacks of
+    the Layers and Stack are not saved, the model loaded has none.
+
+    Parameters
+    ==========
+    obj : Layer or Stack
+    path : str
+    min_buffer_bytes : int
+        Arrays of at least this size are stored raw, out of band, and
+        memory mapped when loaded.
+    """
+    from . import __version__
+    from .picknmix import Layer, Stack
+
+    path = os.path.abspath(path)
+    if os.path.exists(path) and not os.path.exists(
+            os.path.join(path, MANIFEST)):
+        raise FileExistsError("{} exists and is not a saved model".format(
+            path))
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix='.picknmix-', dir=parent)
+    try:
+        writer = _Writer(tmp_dir, min_buffer_bytes, (Layer, Stack))
+        layers = obj.layers if hasattr(obj, 'layers') else [obj]
+        for layer_idx, layer in enumerate(layers):
+            for idx in range(layer.width):
+                writer.add_member(layer.preprocessors[idx],
+                                  'layer{}/preprocessor{}'.format(
+                                      layer_idx, idx))
+                writer.add_member(layer.models[idx],
+                                  'layer{}/model{}'.format(layer_idx, idx))
+        manifest = {
+            'format': FORMAT,
+            'format_version': FORMAT_VERSION,
+            'picknmix_version': __version__,
+            'numpy_version': np.__version__,
+            'class': type(obj).__name__,
+            'skeleton': writer.dump(obj, 'skeleton'),
+            'members': writer.entries,
+        }
+        with open(os.path.join(tmp_dir, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp_dir, path)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+def load(path, mmap_mode='r', lazy=False):
+    """Load a Layer or Stack saved with save
+
+    Parameters
+    ==========
+    path : str
+    mmap_mode : str or None
+        Mode of the memory maps of the raw arrays: 'r' (default) shares
+        them read-only between processes, 'c' gives private writable
+        copies on write and None reads them into memory.
+    lazy : bool
+        If True, the models and preprocessors are not read but replaced by
+        LazyMember handles. The directory must then be kept until they are
+        all loaded.
+
+    Returns
+    =======
+    the Layer or Stack
+    """
+    manifest = read_manifest(path)
+    reader = _Reader(os.path.abspath(path), manifest['members'], mmap_mode,
+                     lazy)
+    return reader.load(manifest['skeleton'])
+
+
+def read_manifest(path):
+    """Return the manifest of the model saved in path, checking that this
+    version of Pick n Mix can read it"""
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != FORMAT:
+        raise ValueError("{} is not a saved Pick n Mix model".format(path))
+    if manifest['format_version'] > FORMAT_VERSION:
+        raise ValueError(
+            "{} was saved in format version {}, this version of Pick n Mix "
+            "reads up to version {}".format(
+                path, manifest['format_version'], FORMAT_VERSION))
+    return manifest
+
+
+class _Writer:
+    def __init__(self, directory, min_buffer_bytes, skeleton_types=()):
+        self.directory = directory
+        self.min_buffer_bytes = min_buffer_bytes
+        # pickled without their callbacks in the skeleton, e.g. loggers or
+        # lambdas cannot be pickled
+        self.dispatch_table = copyreg.dispatch_table.copy()
+        for skeleton_type in skeleton_types:
+            self.dispatch_table[skeleton_type] = _reduce_without_callbacks
+        # manifest entry of each member, by name
+        self.entries = {}
+        # name of each member by id, members shared between models (e.g.
+        # shared preprocessors) are saved once
+        self._names = {}
+
+    def add_member(self, member, name):
+        if member is None:
+            return
+        if id(member) in self._names:
+            return
+        self._names[id(member)] = name
+        self.entries[name] = self.dump(member, name, members=False)
+
+    def dump(self, obj, name, members=True):
+        """Pickle obj to name.pkl, with its large arrays in name.<i>.bin,
+        and return its manifest entry. If members, the members added are
+        referenced instead of pickled again."""
+        pkl_path = os.path.join(self.directory, name + '.pkl')
+        os.makedirs(os.path.dirname(pkl_path), exist_ok=True)
+        buffers = []
+
+        def buffer_callback(buffer):
+            raw = buffer.raw()
+            if raw.nbytes < self.min_buffer_bytes:
+                return True
+            buffer_name = '{}.{}.bin'.format(name, len(buffers))
+            with open(os.path.join(self.directory, buffer_name), 'wb') as f:
+                f.write(raw)
+            buffers.append(buffer_name)
+            return False
+
+        with open(pkl_path, 'wb') as f:
+            if pickle.HIGHEST_PROTOCOL >= 5:
+                pickler = pickle.Pickler(f, protocol=5,
+                                         buffer_callback=buffer_callback)
+            else:
+                pickler = pickle.Pickler(f, protocol=pickle.HIGHEST_PROTOCOL)
+            if members:
+                pickler.persistent_id = self._persistent_id
+                pickler.dispatch_table = self.dispatch_table
+            pickler.dump(obj)
+        return {'file': name + '.pkl', 'buffers': buffers}
+
+    def _persistent_id(self, obj):
+        return self._names.get(id(obj))
+
+
+def _reduce_without_callbacks(obj):
+    state = obj.__getstate__()
+    state['callbacks'] = []
+    return object.__new__, (type(obj),), state
+
+
+class LazyMember:
+    def __init__(self, reader, name):
+        """Handle of a model or preprocessor of a saved model, read from the
+        disk by load(). Copying or pickling the handle loads the member."""
+        self.reader = reader
+        self.name = name
+
+    def __repr__(self):
+        return 'LazyMember({!r})'.format(self.name)
+
+    def __reduce__(self):
+        return _identity, (self.load(),)
+
+    def load(self):
+        """Return the member, read the first time only"""
+        return self.reader.member(self.name)
+
+
+def _identity(obj):
+    return obj
+
+
+class _Reader:
+    def __init__(self, directory, entries, mmap_mode, lazy=False):
+        self.directory = directory
+        self.entries = entries
+        self.mmap_mode = mmap_mode
+        self.lazy = lazy
+        self._members = {}
+        self._handles = {}
+        self._lock = threading.Lock()
+
+    def reference(self, name):
+        """The member name, or a handle of it if loading lazily. Members
+        referenced several times get the same handle."""
+        if not self.lazy:
+            return self.member(name)
+        if name not in self._handles:
+            self._handles[name] = LazyMember(self, name)
+        return self._handles[name]
+
+    def member(self, name):
+        with self._lock:
+            if name not in self._members:
+                self._members[name] = self.load(self.entries[name],
+                                                members=False)
+            return self._members[name]
+
+    def load(self, entry, members=True):
+        buffers = [self._buffer(buffer_name)
+                   for buffer_name in entry['buffers']]
+        with open(os.path.join(self.directory, entry['file']), 'rb') as f:
+            if buffers:
+                unpickler = pickle.Unpickler(f, buffers=buffers)
+            else:
+                unpickler = pickle.Unpickler(f)
+            if members:
+                unpickler.persistent_load = self.reference
+            return unpickler.load()
+
+    def _buffer(self, buffer_name):
+        buffer_path = os.path.join(self.directory, buffer_name)
+        if self.mmap_mode is None or os.path.getsize(buffer_path) == 0:
+            with open(buffer_path, 'rb') as f:
+                return bytearray(f.read())
+        return np.memmap(buffer_path, dtype=np.uint8, mode=self.mmap_mode)
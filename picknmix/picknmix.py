@@ -6,14 +6,29 @@ It provided 2 classes:
 Layer and Stack. Layer is a parallel combination of models,
 while Stack combine Layers to create a stacking model"""
 
-from copy import deepcopy
+from copy import deepcopy, copy
+import os
+import asyncio
+import hashlib
+import inspect
 import numpy as np
 import warnings
 import importlib
+from time import perf_counter
+from collections import namedtuple
+
+from .parallel import (parallel_map, executor_map, make_pool, check_backend,
+                       shares_memory)
+from .cache import (LayerOutputCache, MemberCache, RowPredictionCache,
+                    _estimator_fingerprint, _update_digest)
+from . import persist
+from .distributed import submit_tasks
 
 
 class Layer:
-    def __init__(self, models, preprocessors=None, proba=False):
+    def __init__(self, models, preprocessors=None, proba=False, n_jobs=None,
+                 backend='threading', dtype=None, cache=None, callbacks=None,
+                 passthrough=False, ownership='copy'):
         """Initialize Layer, create a parallel combination of Sci-Kit learn models
         with or without preprocessors
 
@@ -29,7 +44,46 @@ class Layer:
             Bool or a list of bool to show if predict_proba should be use
             instaed of predict, useful for classifiers not in the final Layer.
             If is a list,the length must match the number models.
+        n_jobs:
+            Number of models to fit and predict concurrently. None (default)
+            means 1, -1 means using all processors.
+        backend:
+            'threading' (default), 'multiprocessing' or 'joblib', how the
+            models are run concurrently when n_jobs is not 1.
+        dtype:
+            Data type of the predictions returned for the next Layer,
+            e.g. np.float32 to half the memory used. If None (default) the
+            common type of the predictions of all models is used.
+        cache:
+            A MemberCache, or the path of its directory, if not None. fit
+            then reloads the models already fitted with the same parameters
+            on the same data from the cache instead of fitting them again.
+        callbacks:
+            A list of callables, each one is called with the report of every
+            fit, fit_oof and predict. The report of the last call is also kept
+            in Layer.report, a dict with the method ('fit', 'fit_oof' or
+            'predict'), n_samples, time (in seconds), rows_per_sec,
+            output_shape, nbytes and members, a list of the same for each
+            model, with the time spent in preprocess_time, fit_time and
+            predict_time.
+        passthrough:
+            If True, the features given to the Layer are passed to the next
+            Layer along with the predictions, as the first columns. Sparse
+            features stay sparse: the output is then a CSR matrix.
+        ownership:
+            How the Layer takes the models and preprocessors given.
+            'copy' (default) makes a deep copy of them, fitted or not.
+            'clone' makes unfitted copies of them from their parameters
+            (get_params), which is fast even for large fitted models.
+            'share' uses them as they are without copying: fitted models
+            predict as they are, and a model is only replaced by an unfitted
+            copy of itself when the Layer fits it, so the original objects
+            are never changed (copy-on-write).
         """
+        if ownership not in OWNERSHIPS:
+            raise ValueError("Unknown ownership {}, expected one of {}".format(
+                ownership, OWNERSHIPS))
+
         if preprocessors is not None:
             assert len(preprocessors) == len(models), """Number of
              preprocessors and models does not match, got {} processors but
@@ -43,18 +97,108 @@ class Layer:
         self.width = len(models)
 
         if preprocessors is None:
-            self.preprocessors = [None] * self.width
-        else:
+            preprocessors = [None] * self.width
+        if ownership == 'copy':
             self.preprocessors = deepcopy(preprocessors)
-
-        self.models = deepcopy(models)
+            self.models = deepcopy(models)
+        elif ownership == 'clone':
+            self.preprocessors = [_clone_estimator(preprocessor)
+                                  for preprocessor in preprocessors]
+            self.models = [_clone_estimator(model) for model in models]
+        else:
+            self.preprocessors = list(preprocessors)
+            self.models = list(models)
+        # members which are shared with other objects, they are cloned
+        # before being fitted
+        self._shared_members = [ownership == 'share'] * self.width
 
         if type(proba) == bool:
             self.proba = [proba] * self.width
         else:
             self.proba = deepcopy(proba)
 
-    def fit(self, X, y):
+        self.n_jobs = n_jobs
+        self.backend = check_backend(backend)
+        self.dtype = dtype
+        if cache is not None and not isinstance(cache, MemberCache):
+            cache = MemberCache(cache)
+        self.cache = cache
+        self.callbacks = [] if callbacks is None else list(callbacks)
+        # timings and sizes of the last fit, fit_oof or predict
+        self.report = None
+        # layout of the predictions, learnt in fit
+        self.output_widths = None
+        self.output_dtype = None
+        self.passthrough = passthrough
+        self.n_features_in = None
+        # method giving the predictions of each model ('predict_proba' or
+        # 'predict') and the models using predict instead of predict_proba,
+        # decided in fit
+        self.predict_methods = None
+        self.proba_fallbacks = None
+        # Layers fitted on each fold by fit_oof when refit is False
+        self.fold_layers = None
+        # (X, y) of the batches seen by partial_fit, for the members which
+        # cannot learn incrementally
+        self._partial_buffer = None
+        self._pool = None
+        self._own_pool = False
+        # True if members are handles to load, see Layer.load
+        self._lazy = False
+
+    def __getstate__(self):
+        # a worker pool cannot be pickled nor copied
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        state['_own_pool'] = False
+        return state
+
+    def __deepcopy__(self, memo):
+        return _deepcopy_sharing_callbacks(self, memo)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close_pool()
+
+    def open_pool(self, n_jobs=None, pool=None):
+        """Attach a persistent pool of workers to the Layer, predict will
+        then run the models concurrently on the pool without creating
+        new workers on every call. Useful for serving a fitted Layer online.
+
+        Parameters
+        ==========
+        n_jobs : int or None
+            Number of threads in the pool, default to the n_jobs of the Layer.
+        pool : Executor, optional
+            An existing executor (e.g. concurrent.futures.ThreadPoolExecutor)
+            to use instead of creating a new one. It will not be shut down
+            by close_pool.
+
+        Returns
+        =======
+        self : object, the Layer itself, can be used as a context manager
+               which closes the pool on exit.
+        """
+        self.close_pool()
+        if pool is None:
+            self._pool = make_pool(self.n_jobs if n_jobs is None else n_jobs)
+            self._own_pool = True
+        else:
+            self._pool = pool
+            self._own_pool = False
+        return self
+
+    def close_pool(self):
+        """Detach the pool of workers from the Layer, shutting it down if it
+        was created by open_pool"""
+        if self._pool is not None and self._own_pool:
+            self._pool.shutdown(wait=True)
+        self._pool = None
+        self._own_pool = False
+
+    def fit(self, X, y, executor=None):
         """Fit each preprocessors and models in Layer with (X, y) and
         return predictions in an array of shape (n_samples, n_models) for
         the next Layer
@@ -65,41 +209,316 @@ class Layer:
             Training data
         y : array_like, shape (n_samples, n_targets)
             Target values.
+        executor : optional
+            A cluster to fit the members on instead of n_jobs and backend,
+            e.g. a LocalCluster or a dask.distributed.Client, see
+            picknmix.distributed. (X, y) is scattered to it once and each
+            member is fitted, with its own preprocessor, in a task.
 
         Returns
         =======
         C : array, shape (n_samples, n_models)
             Returns predicted values for the next layer.
         """
-        result = None
+        start_time = perf_counter()
+        if self._lazy:
+            self.warm_up()
+        self._own_members()
+        fitted = [None] * self.width
+        timings = [None] * self.width
+        if self.cache is not None:
+            data_key = self.cache.data_key(X, y)
+            keys = [self.cache.member_key(self.preprocessors[idx],
+                                          self.models[idx], self.proba[idx],
+                                          data_key)
+                    for idx in range(self.width)]
+            fitted = [None if key is None else self.cache.load(key)
+                      for key in keys]
+
+        to_fit = [idx for idx in range(self.width) if fitted[idx] is None]
+        if executor is None:
+            X_members, preprocess_times = self._shared_preprocessing(
+                X, to_fit, fit=True)
+            tasks = [(None, self.models[idx], self.proba[idx],
+                      X_members.get(idx, X), y) for idx in to_fit]
+            results = parallel_map(_fit_member, tasks, n_jobs=self.n_jobs,
+                                   backend=self.backend)
+        else:
+            X_ref, y_ref = executor.scatter(X), executor.scatter(y)
+            tasks = [(self.preprocessors[idx], self.models[idx],
+                      self.proba[idx], X_ref, y_ref) for idx in to_fit]
+            results = submit_tasks(executor, _fit_member, tasks)
+            preprocess_times = None
+        for idx, (preprocessor, model, temp_result, timing) in zip(to_fit,
+                                                                   results):
+            if preprocessor is None:
+                # fitted by _shared_preprocessing, if any
+                preprocessor = self.preprocessors[idx]
+            fitted[idx] = (preprocessor, model, temp_result)
+            if preprocess_times is not None:
+                timing['preprocess'] = preprocess_times.get(idx, 0.0)
+            timings[idx] = timing
+            if self.cache is not None and keys[idx] is not None:
+                self.cache.store(keys[idx], fitted[idx])
+        self.fold_layers = None
+
+        results = []
+        for idx, (preprocessor, model, temp_result) in enumerate(fitted):
+            # models fitted in other processes are returned as new objects
+            self.preprocessors[idx] = preprocessor
+            self.models[idx] = model
+            results.append(temp_result)
+        # members reloaded from the cache share their preprocessors too
+        self._share_preprocessors()
+        self._resolve_methods()
+        return self._fitted_output(X, results, 'fit', start_time, timings)
+
+    def partial_fit(self, X, y, classes=None, buffer_size=None):
+        """Update the Layer with a new batch (X, y) and return predictions
+        of X, in an array of shape (n_samples, n_models), for the next
+        Layer. The members whose model and preprocessor (if any) have a
+        partial_fit method, e.g. SGDClassifier, MultinomialNB or
+        StandardScaler, learn from the batch incrementally. The others are
+        fitted again on all the batches seen, kept in a buffer.
+
+        Parameters
+        ==========
+        X : array-like or sparse matrix, shape (n_samples, n_features)
+            Training data of the batch
+        y : array_like, shape (n_samples, n_targets)
+            Target values of the batch.
+        classes : array-like, optional
+            All the classes of y, required by the partial_fit of the
+            classifiers on the first batch, see scikit-learn.
+        buffer_size : int, optional
+            If given, the buffer only keeps the buffer_size most recent rows,
+            i.e. the members without partial_fit are fitted on a sliding
+            window. It always keeps at least the rows of the batch.
+
+        Returns
+        =======
+        C : array, shape (n_samples, n_models)
+            Returns predicted values for the next layer.
+        """
+        start_time = perf_counter()
+        if self._lazy:
+            self.warm_up()
+        # incremental members are updated, so they are copied with their
+        # fitted state instead of cloned
+        self._own_members(keep_state=True)
+        incremental = [
+            _method_checker(self.models[idx], 'partial_fit')
+            and (self.preprocessors[idx] is None
+                 or _method_checker(self.preprocessors[idx], 'partial_fit'))
+            for idx in range(self.width)]
+        n_samples = _num_samples(X)
+        if all(incremental):
+            self._partial_buffer = None
+        else:
+            self._buffer_batch(X, y, buffer_size)
+            X_buffer, y_buffer = self._partial_buffer
+
+        # each distinct preprocessor is updated once
+        groups = self._preprocessor_groups(
+            [idx for idx in range(self.width) if incremental[idx]])
+        X_members = {}
+        preprocess_times = {}
+        for group in groups:
+            preprocessor_start = perf_counter()
+            preprocessor = self.preprocessors[group[0]]
+            X_new = preprocessor.partial_fit(X).transform(X)
+            for idx in group:
+                X_members[idx] = X_new
+                preprocess_times[idx] = perf_counter() - preprocessor_start
+
+        tasks = []
         for idx in range(self.width):
-            if self.preprocessors[idx] is not None:
-                X_new = self.preprocessors[idx].fit_transform(X)
+            if incremental[idx]:
+                tasks.append((None, self.models[idx], self.proba[idx],
+                              X_members.get(idx, X), y, classes, None))
             else:
-                X_new = X
-
-            self.models[idx].fit(X_new, y)
-
-            if self.proba[idx]:
-                if _method_checker(self.models[idx], 'predict_proba'):
-                    temp_result = self.models[idx].predict_proba(X_new)
-                else:
-                    warnings.warn("""Warning: predict_proba not exist for
-                        {}, using predict instead""".format(
-                        self.models[idx].__class__))
-                    temp_result = self.models[idx].predict(X_new)
-                    temp_result = np.expand_dims(temp_result, axis=1)
-            else:
-                temp_result = self.models[idx].predict(X_new)
-                temp_result = np.expand_dims(temp_result, axis=1)
+                # the preprocessor may be shared with incremental members
+                tasks.append((_clone_estimator(self.preprocessors[idx]),
+                              self.models[idx], self.proba[idx], X_buffer,
+                              y_buffer, None, n_samples))
+        fitted = parallel_map(_partial_fit_member, tasks, n_jobs=self.n_jobs,
+                              backend=self.backend)
+        self.fold_layers = None
+        results = []
+        timings = []
+        for idx, (preprocessor, model, result, timing) in enumerate(fitted):
+            if preprocessor is not None:
+                self.preprocessors[idx] = preprocessor
+            self.models[idx] = model
+            results.append(result)
+            if incremental[idx]:
+                timing['preprocess'] = preprocess_times.get(idx, 0.0)
+            timings.append(timing)
+        self._resolve_methods(warn=self.predict_methods is None)
+        return self._fitted_output(X, results, 'partial_fit', start_time,
+                                   timings)
 
-            if result is None:
-                result = temp_result
-            else:
-                result = np.concatenate((result, temp_result), axis=1)
-        return result
+    def _buffer_batch(self, X, y, buffer_size):
+        """Add (X, y) to the rows buffered for the members refitted by
+        partial_fit, keeping the buffer_size most recent rows"""
+        if self._partial_buffer is None:
+            # the caller may reuse its arrays for the next batch
+            X_buffer, y_buffer = deepcopy(X), deepcopy(y)
+        else:
+            X_buffer = _concat_rows([self._partial_buffer[0], X])
+            y_buffer = _concat_rows([self._partial_buffer[1], y])
+        n_rows = _num_samples(X_buffer)
+        if buffer_size is not None:
+            # the members predict the batch from the end of the buffer
+            buffer_size = max(buffer_size, _num_samples(X))
+        if buffer_size is not None and n_rows > buffer_size:
+            rows = np.arange(n_rows - buffer_size, n_rows)
+            X_buffer = _take_rows(X_buffer, rows)
+            y_buffer = _take_rows(y_buffer, rows)
+        self._partial_buffer = (X_buffer, y_buffer)
 
-    def predict(self, X):
+    def _fitted_output(self, X, results, method, start_time, timings,
+                       out=None):
+        """Set the layout of the output from results, the predictions of
+        each member on X after fitting, and return the output, out if
+        given"""
+        self.output_widths = [result.shape[1] for result in results]
+        if self.dtype is None:
+            self.output_dtype = np.result_type(*results)
+        else:
+            self.output_dtype = np.dtype(self.dtype)
+        self._set_n_features_in(X)
+        out, meta = self._allocate_output(X, out)
+        for (start, stop), result in zip(self._output_slices(), results):
+            meta[:, start:stop] = result
+        out = self._finish_output(X, out, meta)
+        self._make_report(method, start_time, meta, timings, out)
+        return out
+
+    def fit_oof(self, X, y, cv=5, refit=True, executor=None):
+        """Fit the Layer with K-fold cross-fitting and return out-of-fold
+        predictions of every row of X, in an array of shape
+        (n_samples, n_models), for the next Layer. The prediction of each row
+        is made by models that have not seen it in training, so the next
+        Layer is trained without leakage. All folds and models are fitted
+        concurrently according to n_jobs and backend.
+
+        Parameters
+        ==========
+        X : array-like or sparse matrix, shape (n_samples, n_features)
+            Training data
+        y : array_like, shape (n_samples, n_targets)
+            Target values.
+        cv : int, cross-validator or list of (train, test) index pairs
+            The folds, an int is the number of contiguous folds, a
+            cross-validator from sci-kit learn (e.g. KFold, StratifiedKFold)
+            is split on (X, y). The test sets must cover every row once.
+        refit : bool
+            If True (default) the models are also fitted on all of (X, y) and
+            used in predict. If False, predict returns the average of the
+            predictions of the models fitted on each fold, which saves one
+            fit but only make sense for regression or with proba.
+        executor : optional
+            A cluster to fit the members on, see fit. (X, y) is scattered to
+            it once and each task takes the rows of its fold from it.
+
+        Returns
+        =======
+        C : array, shape (n_samples, n_models)
+            Returns out-of-fold predicted values for the next layer.
+        """
+        start_time = perf_counter()
+        if self._lazy:
+            self.warm_up()
+        self._own_members()
+        X = _as_row_indexable(X)
+        splits = _get_splits(cv, X, y)
+        n_samples = _num_samples(X)
+        _check_partition(splits, n_samples)
+
+        fold_layers = [self.copy() for _ in splits]
+        for fold_layer in fold_layers:
+            fold_layer.passthrough = False
+        if executor is None:
+            X_data, y_data = X, y
+        else:
+            X_data, y_data = executor.scatter(X), executor.scatter(y)
+        tasks = []
+        for fold_layer, (train, test) in zip(fold_layers, splits):
+            for idx in range(self.width):
+                tasks.append((fold_layer.preprocessors[idx],
+                              fold_layer.models[idx], self.proba[idx],
+                              X_data, y_data, train, test))
+        if refit:
+            # the final fit on all data runs along with the folds
+            for idx in range(self.width):
+                tasks.append((self.preprocessors[idx], self.models[idx],
+                              self.proba[idx], X_data, y_data, None, None))
+        if executor is None:
+            fitted = parallel_map(_cross_fit_member_rows, tasks,
+                                  n_jobs=self.n_jobs, backend=self.backend)
+        else:
+            fitted = submit_tasks(executor, _cross_fit_member_rows, tasks)
+
+        # timings of each member are summed over the folds
+        timings = [dict.fromkeys(('preprocess', 'fit', 'predict'), 0.0)
+                   for _ in range(self.width)]
+        for task_idx, (_, _, _, timing) in enumerate(fitted):
+            for stage, elapsed in timing.items():
+                timings[task_idx % self.width][stage] += elapsed
+
+        fold_results = []
+        for fold_idx, fold_layer in enumerate(fold_layers):
+            results = []
+            for idx in range(self.width):
+                preprocessor, model, result, _ = fitted[
+                    fold_idx * self.width + idx]
+                fold_layer.preprocessors[idx] = preprocessor
+                fold_layer.models[idx] = model
+                results.append(result)
+            fold_results.append(results)
+        output_widths = [result.shape[1] for result in fold_results[0]]
+        for results in fold_results:
+            if [result.shape[1] for result in results] != output_widths:
+                raise ValueError("""The models return a different number of
+                    columns on different folds, e.g. a class is missing in
+                    the training data of a fold""")
+
+        self.output_widths = output_widths
+        if self.dtype is None:
+            self.output_dtype = np.result_type(
+                *[result for results in fold_results for result in results])
+        else:
+            self.output_dtype = np.dtype(self.dtype)
+        for fold_layer in fold_layers:
+            fold_layer.output_widths = self.output_widths
+            fold_layer.output_dtype = self.output_dtype
+            fold_layer._share_preprocessors()
+            fold_layer._resolve_methods(warn=False)
+
+        if refit:
+            for idx in range(self.width):
+                preprocessor, model, _, _ = fitted[
+                    len(splits) * self.width + idx]
+                self.preprocessors[idx] = preprocessor
+                self.models[idx] = model
+            self.fold_layers = None
+        else:
+            self.fold_layers = fold_layers
+        self._share_preprocessors()
+        self._resolve_methods()
+
+        self._set_n_features_in(X)
+        out, meta = self._allocate_output(X)
+        slices = self._output_slices()
+        for (_, test), results in zip(splits, fold_results):
+            for (start, stop), result in zip(slices, results):
+                meta[test, start:stop] = result
+        out = self._finish_output(X, out, meta)
+        self._make_report('fit_oof', start_time, meta, timings, out)
+        return out
+
+    def predict(self, X, out=None):
         """With put fiting any preprocessors and models in Layer, return predictions
         of X in an array of shape (n_samples, n_models) for the next Layer
 
@@ -107,83 +526,384 @@ class Layer:
         ==========
         X : array-like or sparse matrix, shape (n_samples, n_features)
             Samples
+        out : array, shape (n_samples, n_outputs), optional
+            If given, the predictions are written directly in it instead of
+            a newly allocated array. n_outputs is the sum of output_widths
+            (plus n_features_in with passthrough).
 
         Returns
         =======
         C : array, shape (n_samples, n_models)
             Returns predicted values for the next layer.
         """
-        result = None
-        for idx in range(self.width):
-            if self.preprocessors[idx] is not None:
-                X_new = self.preprocessors[idx].transform(X)
-            else:
-                X_new = X
-
-            if self.proba[idx]:
-                if _method_checker(self.models[idx], 'predict_proba'):
-                    temp_result = self.models[idx].predict_proba(X_new)
-                else:
-                    warnings.warn("""Warning: predict_proba not exist for {},
-                         using predict instead""".format(
-                        self.models[idx].__class__))
-                    temp_result = self.models[idx].predict(X_new)
-                    temp_result = np.expand_dims(temp_result, axis=1)
-            else:
-                temp_result = self.models[idx].predict(X_new)
-                temp_result = np.expand_dims(temp_result, axis=1)
+        start_time = perf_counter()
+        if self._lazy:
+            self.warm_up()
+        if self.output_widths is None:
+            # layout unknown, e.g. models fitted before being given to the
+            # Layer: the models raise if they are not fitted, otherwise the
+            # layout is learnt from their predictions
+            X_members, preprocess_times = self._shared_preprocessing(
+                X, range(self.width))
+            tasks = [(None, self.models[idx],
+                      _prediction_method(self.models[idx], self.proba[idx]),
+                      X_members.get(idx, X)) for idx in range(self.width)]
+            results = parallel_map(_predict_member, tasks, n_jobs=self.n_jobs,
+                                   backend=self.backend)
+            timings = []
+            for idx, (_, timing) in enumerate(results):
+                timing['preprocess'] = preprocess_times.get(idx, 0.0)
+                timings.append(timing)
+            self._resolve_methods()
+            return self._fitted_output(X, [result for result, _ in results],
+                                       'predict', start_time, timings, out)
 
-            if result is None:
-                result = temp_result
-            else:
-                result = np.concatenate((result, temp_result), axis=1)
-        return result
+        out, meta = self._allocate_output(X, out)
 
-    def _isSklearnEstimator(self, estimator):
-        """ Checks whether the given object is an estimator of sklearn-library
-        (Code from sklearn.base.clone())
-        """
-        return hasattr(estimator, 'get_params') and not isinstance(estimator, type)
+        if self.fold_layers is not None:
+            # average of the models fitted on each fold
+            meta[...] = np.mean([fold_layer.predict(X)
+                                 for fold_layer in self.fold_layers], axis=0)
+            out = self._finish_output(X, out, meta)
+            self._make_report('predict', start_time, meta, output=out)
+            return out
+
+        X_members, preprocess_times = self._shared_preprocessing(
+            X, range(self.width))
+        # threads write the predictions directly into out, processes
+        # return them
+        if self._pool is not None:
+            into_meta = shares_memory(self._pool)
+        else:
+            into_meta = self.backend == 'threading'
+        tasks = self._predict_tasks(X, X_members, meta, into_meta)
+        if self._pool is not None:
+            results = executor_map(self._pool, _predict_member, tasks)
+        else:
+            results = parallel_map(_predict_member, tasks, n_jobs=self.n_jobs,
+                                   backend=self.backend)
+        timings = self._collect_predictions(meta, results, preprocess_times)
+        out = self._finish_output(X, out, meta)
+        self._make_report('predict', start_time, meta, timings, out)
+        return out
+
+    async def apredict(self, X, out=None, executor=None):
+        """Same as predict, as a coroutine for asyncio: the preprocessors
+        and the models are run concurrently in an executor and awaited, so
+        the event loop keeps serving other requests meanwhile.
 
-    def _cloneObject(self, estimator, moduleObject=None):
-        """Abstract method for cloning a presumed estimator object
+        Parameters
+        ==========
+        X : array-like or sparse matrix, shape (n_samples, n_features)
+            Samples
+        out : array, shape (n_samples, n_outputs), optional
+            See predict.
+        executor : concurrent.futures.Executor, optional
+            Where the models are run, by default the pool of open_pool if
+            opened or else the default executor of the event loop.
+
+        Returns
+        =======
+        C : array, shape (n_samples, n_models)
+            Returns predicted values for the next layer.
         """
-        copyEstimator = None
-        if estimator is not None:
-            if self._isSklearnEstimator(estimator) and \
-               moduleObject is not None and "sklearn" in moduleObject:
-                cloneMethod = getattr(moduleObject["sklearn"], "clone")
-                copyEstimator = cloneMethod(estimator)
-            else:
-                copyEstimator = deepcopy(estimator)
-        return copyEstimator
+        start_time = perf_counter()
+        loop = asyncio.get_event_loop()
+        if executor is None:
+            executor = self._pool
+        # processes cannot change the Layer nor write into out
+        into_meta = shares_memory(executor)
+        local_executor = executor if into_meta else None
+        if self._lazy:
+            await loop.run_in_executor(local_executor, self.warm_up)
+        if self.output_widths is None or self.fold_layers is not None:
+            # predict sends the models to the pool of open_pool, waiting for
+            # it from a thread of the same pool could deadlock
+            return await loop.run_in_executor(None, self.predict, X, out)
+
+        out, meta = self._allocate_output(X, out)
+        groups = self._preprocessor_groups(range(self.width))
+        transformed = await asyncio.gather(*[
+            loop.run_in_executor(executor, _preprocess,
+                                 self.preprocessors[group[0]], X, False)
+            for group in groups])
+        X_members, preprocess_times = self._assign_preprocessed(groups,
+                                                                transformed)
+        results = await asyncio.gather(*[
+            loop.run_in_executor(executor, _predict_member, *task)
+            for task in self._predict_tasks(X, X_members, meta, into_meta)])
+        timings = self._collect_predictions(meta, results, preprocess_times)
+        out = self._finish_output(X, out, meta)
+        self._make_report('predict', start_time, meta, timings, out)
+        return out
+
+    def _predict_tasks(self, X, X_members, meta, into_meta):
+        """Arguments of _predict_member for each member, writing the
+        predictions directly into meta if into_meta"""
+        if into_meta:
+            return [(None, self.models[idx], self.predict_methods[idx],
+                     X_members.get(idx, X), meta[:, start:stop])
+                    for idx, (start, stop) in enumerate(
+                        self._output_slices())]
+        return [(None, self.models[idx], self.predict_methods[idx],
+                 X_members.get(idx, X)) for idx in range(self.width)]
 
-    def copy(self):
+    def _collect_predictions(self, meta, results, preprocess_times):
+        """Copy the predictions of the members not written into meta yet and
+        return the timings of the members"""
+        timings = []
+        for idx, ((start, stop), (result, timing)) in enumerate(
+                zip(self._output_slices(), results)):
+            if result is not None:
+                meta[:, start:stop] = result
+            timing['preprocess'] = preprocess_times.get(idx, 0.0)
+            timings.append(timing)
+        return timings
+
+    def _shared_preprocessing(self, X, members, fit=False):
+        """Transform X once per distinct preprocessor of the members, instead
+        of once per member, and return a dict of the transformed X of each
+        member with a preprocessor, along with a dict of the time spent in
+        the preprocessor of each member.
+        When fitting, preprocessors of the same class and parameters are
+        equivalent: only one is fitted and it is shared by all the members.
+        When predicting, members share the same preprocessor object."""
+        groups = self._preprocessor_groups(members, fit)
+        if not groups:
+            return {}, {}
+
+        tasks = [(self.preprocessors[group[0]], X, fit) for group in groups]
+        if self._pool is not None and not fit:
+            transformed = executor_map(self._pool, _preprocess, tasks)
+        else:
+            transformed = parallel_map(_preprocess, tasks, n_jobs=self.n_jobs,
+                                       backend=self.backend)
+        return self._assign_preprocessed(groups, transformed)
+
+    def _preprocessor_groups(self, members, fit=False):
+        """Lists of the members sharing the same preprocessor, see
+        _shared_preprocessing"""
+        groups = {}
+        for idx in members:
+            preprocessor = self.preprocessors[idx]
+            if preprocessor is None:
+                continue
+            key = None
+            if fit:
+                key = _estimator_fingerprint(preprocessor)
+            if key is None:
+                key = id(preprocessor)
+            groups.setdefault(key, []).append(idx)
+        return list(groups.values())
+
+    def _assign_preprocessed(self, groups, transformed):
+        """Dicts of the transformed X and of the preprocessing time of each
+        member, from the results of _preprocess on each group"""
+        X_members = {}
+        preprocess_times = {}
+        for group, (preprocessor, X_new, elapsed) in zip(groups, transformed):
+            for idx in group:
+                self.preprocessors[idx] = preprocessor
+                X_members[idx] = X_new
+                preprocess_times[idx] = elapsed
+        return X_members, preprocess_times
+
+    def _make_report(self, method, start_time, meta, timings=None,
+                     output=None):
+        """Set the report of the last call and pass it to the callbacks.
+        meta is the predictions of the models and output the whole output
+        of the Layer, if different. timings is a list of dict of the time
+        spent in each stage of each member, None if not available"""
+        elapsed = perf_counter() - start_time
+        if output is None:
+            output = meta
+        n_samples = meta.shape[0]
+        members = []
+        for idx, (start, stop) in enumerate(self._output_slices()):
+            member = {'index': idx,
+                      'model': type(self.models[idx]).__name__,
+                      'preprocessor': None,
+                      'output_shape': (n_samples, stop - start),
+                      'nbytes': n_samples * (stop - start) * meta.itemsize}
+            if self.preprocessors[idx] is not None:
+                member['preprocessor'] = type(
+                    self.preprocessors[idx]).__name__
+            if timings is not None and timings[idx] is not None:
+                member.update({stage + '_time': timing for stage, timing
+                               in timings[idx].items()})
+                member['cached'] = False
+                member['rows_per_sec'] = _rate(n_samples,
+                                               sum(timings[idx].values()))
+            elif timings is not None:
+                member['cached'] = True
+            members.append(member)
+
+        self.report = {'event': 'layer', 'method': method,
+                       'n_samples': n_samples, 'time': elapsed,
+                       'rows_per_sec': _rate(n_samples, elapsed),
+                       'output_shape': output.shape,
+                       'nbytes': _nbytes(output), 'members': members}
+        for callback in self.callbacks:
+            callback(self.report)
+
+    def _resolve_methods(self, warn=True):
+        """Decide once which method of each fitted model gives its
+        predictions, and warn once about the models without predict_proba"""
+        self.predict_methods = [
+            _prediction_method(model, proba)
+            for model, proba in zip(self.models, self.proba)]
+        self.proba_fallbacks = [
+            idx for idx, method in enumerate(self.predict_methods)
+            if self.proba[idx] and method == 'predict']
+        if warn and self.proba_fallbacks:
+            warnings.warn("""Warning: predict_proba not exist for {},
+                using predict instead""".format(
+                ', '.join(str(self.models[idx].__class__)
+                          for idx in self.proba_fallbacks)))
+
+    def _share_preprocessors(self):
+        """Make members with equivalent fitted preprocessors share one"""
+        shared = {}
+        for idx, preprocessor in enumerate(self.preprocessors):
+            if preprocessor is not None:
+                key = _estimator_fingerprint(preprocessor)
+                if key is not None:
+                    self.preprocessors[idx] = shared.setdefault(key,
+                                                                preprocessor)
+
+    @property
+    def n_outputs(self):
+        """Number of columns of the predictions for the next Layer"""
+        if self.output_widths is None:
+            return None
+        if self.passthrough:
+            return self.n_features_in + sum(self.output_widths)
+        return sum(self.output_widths)
+
+    def _set_n_features_in(self, X):
+        if self.passthrough:
+            self.n_features_in = _num_features(X)
+        else:
+            self.n_features_in = None
+
+    def _output_slices(self):
+        slices = []
+        start = 0
+        for width in self.output_widths:
+            slices.append((start, start + width))
+            start += width
+        return slices
+
+    def _allocate_output(self, X, out=None):
+        """Return the output array of the Layer for X, out if given, and the
+        view of it where the models write their predictions. With passthrough
+        of dense X, the first columns of the output are for X, with sparse X
+        there is no output array yet, see _finish_output"""
+        n_samples = _num_samples(X)
+        n_meta = sum(self.output_widths)
+        if self.passthrough and _is_sparse(X):
+            if out is not None:
+                raise ValueError("out cannot be used with passthrough of a "
+                                 "sparse matrix")
+            return None, np.empty((n_samples, n_meta),
+                                  dtype=self.output_dtype)
+
+        if out is None:
+            dtype = self.output_dtype
+            if self.passthrough and self.dtype is None:
+                dtype = np.result_type(_dtype_of(X), dtype)
+            out = np.empty((n_samples, self.n_outputs), dtype=dtype)
+        elif out.shape != (n_samples, self.n_outputs):
+            raise ValueError("out has shape {}, expected {}".format(
+                out.shape, (n_samples, self.n_outputs)))
+        if self.passthrough:
+            return out, out[:, self.n_features_in:]
+        return out, out
+
+    def _finish_output(self, X, out, meta):
+        """Put X in the output of the Layer with passthrough"""
+        if not self.passthrough:
+            return out
+        if out is None:
+            sparse = importlib.import_module('scipy.sparse')
+            return sparse.hstack([X, sparse.csr_matrix(meta)], format='csr')
+        out[:, :self.n_features_in] = X
+        return out
+
+    def _own_members(self, keep_state=False):
+        """Replace the shared members by unfitted copies before fitting, or
+        by deep copies if keep_state"""
+        copy_member = deepcopy if keep_state else _clone_estimator
+        for idx in range(self.width):
+            if self._shared_members[idx]:
+                self.preprocessors[idx] = copy_member(self.preprocessors[idx])
+                self.models[idx] = copy_member(self.models[idx])
+                self._shared_members[idx] = False
+
+    def warm_up(self):
+        """Load the models and preprocessors of a Layer loaded lazily (see
+        Layer.load) now rather than on first use, and return the Layer"""
+        if self._lazy:
+            self.preprocessors = [_loaded(preprocessor)
+                                  for preprocessor in self.preprocessors]
+            self.models = [_loaded(model) for model in self.models]
+            self._lazy = False
+        return self
+
+    def copy(self, fitted=False):
         """Copies the Layer's shape as it has not been trained before
+
+        Parameters
+        ==========
+        fitted : bool
+            If True, the copy shares the fitted models and preprocessors of
+            the Layer, without copying them, and can predict right away.
+            They are only copied when the copy is fitted (copy-on-write).
+
         Returns
         =======
         the copy of the Layer
         """
-        copyPreprocessors = []
-        copyModels = []
-        try:
-            #package is defined here once and passed to _cloneObject.
-            #When further modules are required, further imports will be necessary
-            moduleObject = {"sklearn": importlib.import_module("sklearn.base")}
-        except(ImportError):
-            moduleObject = None
-        for preprocessor in self.preprocessors:
-            copyPrep = self._cloneObject(preprocessor, moduleObject=moduleObject)
-            copyPreprocessors.append(copyPrep)
-
-        for model in self.models:
-            copyModel = self._cloneObject(model, moduleObject=moduleObject)
-            copyModels.append(copyModel)
-        return Layer(models=copyModels, preprocessors=copyPreprocessors)
+        self.warm_up()
+        if fitted:
+            layer = copy(self)
+            layer.preprocessors = list(self.preprocessors)
+            layer.models = list(self.models)
+            layer.callbacks = list(self.callbacks)
+            layer._shared_members = [True] * self.width
+            layer.report = None
+            layer._pool = None
+            layer._own_pool = False
+            return layer
+
+        layer = Layer(models=[_clone_estimator(model)
+                              for model in self.models],
+                      preprocessors=[_clone_estimator(preprocessor)
+                                     for preprocessor in self.preprocessors],
+                      proba=self.proba, n_jobs=self.n_jobs,
+                      backend=self.backend, dtype=self.dtype,
+                      cache=self.cache, callbacks=self.callbacks,
+                      passthrough=self.passthrough, ownership='share')
+        # the clones belong to the copy only
+        layer._shared_members = [False] * self.width
+        return layer
+
+    def save(self, path):
+        """Save the Layer to the directory path, each model and preprocessor
+        in its own file with its large arrays stored raw, see Stack.save"""
+        persist.save(self.warm_up(), path)
+
+    @staticmethod
+    def load(path, mmap_mode='r', lazy=False):
+        """Load a Layer saved with Layer.save, see Stack.load"""
+        return _load_as(Layer, path, mmap_mode, lazy)
 
 
 class Stack:
-    def __init__(self, layers, folds=None):
+    def __init__(self, layers, folds=None, n_jobs=None, backend=None,
+                 dtype=None, cv=None, refit=True, cache_outputs=False,
+                 cache_dir=None, callbacks=None, passthrough=False,
+                 ownership='copy', row_cache=None):
         """Initialize Stack, create a vertical stacking of Layers
 
         Parameters
@@ -193,12 +913,91 @@ class Stack:
                or TimeSeriesSplit cross-validator from sci-kit learn;
                or a custom list of sets of index for different folds.
                If None (default) all data will be used in training all layers.
+        n_jobs: if not None, set the number of models to run concurrently
+                in every Layer, overriding the n_jobs of the Layers.
+        backend: if not None, set the backend used to run the models
+                 concurrently in every Layer, see Layer.
+        dtype: if not None, set the data type of the predictions passed
+               between Layers, e.g. np.float32, see Layer. The predictions
+               of the last Layer, e.g. labels, keep their own type.
+        cv: if not None, train each Layer on the out-of-fold predictions of
+            the previous Layer on all data, see Layer.fit_oof. It could be
+            an int (number of folds), a cross-validator from sci-kit learn
+            or a custom list of (train, test) index pairs.
+            Cannot be used together with folds.
+        refit: only used with cv, if True (default) the models are also
+               fitted on all data for prediction, see Layer.fit_oof.
+        cache_outputs: if True, the predictions of each Layer but the last
+                       one on each fold of the training data are computed
+                       once and cached, so fit(X, y, start_layer=...) can
+                       reuse them. They are kept until the Stack is fitted
+                       on other data, False (default) keeps nothing.
+        cache_dir: if not None, the cached predictions are spilled to this
+                   directory and memory mapped instead of kept in memory.
+        callbacks: a list of callables, each one is called with the report
+                   of every fit and predict. The report of the last call is
+                   also kept in Stack.report, a dict with the method,
+                   n_samples, time, rows_per_sec and the reports of the
+                   Layers, see Layer.
+        passthrough: if True, every Layer after the first one is given the
+                     original features along with the predictions of the
+                     previous Layer. The original features are copied once
+                     in a buffer next to the predictions instead of being
+                     concatenated for every Layer and fold.
+        ownership: how the Stack takes the layers given. 'copy' (default)
+                   makes a deep copy of them, sharing their callbacks,
+                   'clone' makes unfitted copies
+                   of them (Layer.copy()) and 'share' makes copies sharing
+                   their fitted models, which are only copied when the Stack
+                   fits them (Layer.copy(fitted=True)).
+        row_cache: a RowPredictionCache, if given predict looks up each row
+                   of X in it and only predicts the rows not found, so
+                   repeated rows are not predicted again. It is cleared when
+                   the Stack is fitted.
         """
+        if ownership not in OWNERSHIPS:
+            raise ValueError("Unknown ownership {}, expected one of {}".format(
+                ownership, OWNERSHIPS))
         self.depth = len(layers)
-        self.layers = deepcopy(layers)
+        if ownership == 'copy':
+            self.layers = deepcopy(layers)
+        else:
+            self.layers = [layer.copy(fitted=ownership == 'share')
+                           for layer in layers]
+        self.n_jobs = n_jobs
+        self.backend = backend
+        self.dtype = dtype
+        if backend is not None:
+            check_backend(backend)
+        for layer in self.layers:
+            if n_jobs is not None:
+                layer.n_jobs = n_jobs
+            if backend is not None:
+                layer.backend = backend
+        if dtype is not None:
+            # the final predictions, e.g. labels, keep their own type
+            for layer in self.layers[:-1]:
+                layer.dtype = dtype
         self.use_folds = False
         self.folds = None
         self.splitter = None
+        self.cv = cv
+        self.refit = refit
+        self.cache_outputs = cache_outputs
+        self.cache_dir = cache_dir
+        self.callbacks = [] if callbacks is None else list(callbacks)
+        self.passthrough = passthrough
+        self.row_cache = row_cache
+        # timings and sizes of the last fit or predict, with the reports of
+        # the Layers
+        self.report = None
+        if cache_outputs:
+            self._output_cache = LayerOutputCache(cache_dir)
+        else:
+            self._output_cache = None
+
+        if folds is not None and cv is not None:
+            raise AssertionError("folds and cv cannot be used together")
 
         if folds is not None:
             if _check_custom_folds(folds):
@@ -219,77 +1018,1128 @@ class Stack:
                     self.splitter.n_splits = self.depth
             else:
                 raise AssertionError("{} is not a valid input".format(folds))
+        self._pool = None
+
+    def __getstate__(self):
+        # a worker pool cannot be pickled nor copied
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        return state
+
+    def __deepcopy__(self, memo):
+        return _deepcopy_sharing_callbacks(self, memo)
+
+    def __enter__(self):
+        return self
 
-    def fit(self, X, y):
+    def __exit__(self, *exc_info):
+        self.close_pool()
+
+    def open_pool(self, n_jobs=None):
+        """Create one persistent pool of threads shared by all the Layers,
+        predict will then run the models of each Layer concurrently so the
+        latency of a Layer is close to the one of its slowest model.
+
+        Parameters
+        ==========
+        n_jobs : int or None
+            Number of threads in the pool, default to the n_jobs of the Stack,
+            or the width of the widest Layer if that is None too.
+
+        Returns
+        =======
+        self : object, the Stack itself, can be used as a context manager
+               which closes the pool on exit.
+        """
+        self.close_pool()
+        if n_jobs is None:
+            n_jobs = self.n_jobs
+        if n_jobs is None:
+            n_jobs = max(layer.width for layer in self.layers)
+        self._pool = make_pool(n_jobs)
+        for layer in self.layers:
+            layer.open_pool(pool=self._pool)
+        return self
+
+    def close_pool(self):
+        """Detach the pool of workers from all Layers and shut it down"""
+        for layer in self.layers:
+            layer.close_pool()
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+        self._pool = None
+
+    def fit(self, X, y, start_layer=0, executor=None):
         """Fit Layers with (X, y) and return the fitted Stack
 
         Parameters
         ==========
-        X : array-like or sparse matrix, shape (n_samples, n_features)
-            Training data
+        X : array-like, sparse matrix or np.memmap,
+            shape (n_samples, n_features)
+            Training data, or the path of a .npy file which will be memory
+            mapped instead of loaded in memory.
         y : array_like, shape (n_samples, n_targets)
-            Target values.
+            Target values, or the path of a .npy file.
+        start_layer : int
+            Index of the first Layer to fit, the Layers before it are kept as
+            they are. Their cached predictions are reused if the Stack was
+            fitted on the same (X, y) before, e.g. to try a different last
+            Layer without fitting the others again.
+        executor : optional
+            A cluster to fit the Stack on, e.g. a LocalCluster or a
+            dask.distributed.Client, see picknmix.distributed. The fit is
+            a graph of (layer, member, fold) tasks: the tasks of a Layer only
+            depend on the predictions of the previous Layer, which are
+            scattered to the cluster once, then the tasks are all submitted
+            at once.
 
         Returns
         =======
         self : obejct, the fitted Stack itself
         """
-        if self.use_folds:
-            if self.folds is None:
-                _, self.folds = self.splitter.split(X, y)
-            X_new = X[self.folds[0]]
-            y_new = y[self.folds[0]]
-        else:
-            X_new = X
-
-        for idx in range(self.depth):
+        start_time = perf_counter()
+        if self.row_cache is not None:
+            self.row_cache.clear()
+        X = _as_row_indexable(_load_if_path(X))
+        y = _load_if_path(y)
+        if self.use_folds and self.splitter is not None:
+            self.folds = [test for _, test in self.splitter.split(X, y)]
+        if self._output_cache is not None:
+            token = (_data_token(X, y),)
             if self.use_folds:
-                for pre_idx in range(idx):
-                    X_new = self.layers[pre_idx].predict(X_new)
-                self.layers[idx].fit(X_new, y_new)
+                token += (_folds_token(self.folds),)
+            self._output_cache.reset(token)
+            self._output_cache.invalidate(start_layer)
+
+        splits = None
+        if self.cv is not None:
+            # the same folds are used by all Layers
+            splits = _get_splits(self.cv, X, y)
 
-                if idx < self.depth - 1:
-                    X_new = X[self.folds[idx + 1]]
-                    y_new = y[self.folds[idx + 1]]
+        X_new = None
+        layer_reports = []
+        for idx in range(start_layer, self.depth):
+            if self.use_folds:
+                # contiguous folds (e.g. KFold without shuffle) are views of X
+                # and each fold has its own passthrough buffer
+                X_new = self._layer_input(idx, idx, X, {}, fit=True)
+                self._fit_layer(self.layers[idx], X_new,
+                                _take_rows(y, self.folds[idx]),
+                                executor=executor)
             else:
-                X_new = self.layers[idx].fit(X_new, y)
+                if X_new is None:
+                    blocks = {}
+                    X_new = self._layer_input(idx, None, X, blocks, fit=True)
+                elif self.passthrough:
+                    X_new = self._with_passthrough(idx, None, X_new, X,
+                                                   blocks, fit=True)
+                X_new = self._fit_layer(self.layers[idx], X_new, y, splits,
+                                        executor)
+                # the predictions of the last Layer are not used by the Stack
+                if self._output_cache is not None and idx < self.depth - 1:
+                    X_new = self._output_cache.put((idx, None), X_new)
+            layer_reports.append(self.layers[idx].report)
+        self._make_report('fit', start_time, _num_samples(X), layer_reports)
         return self
 
-    def predict(self, X):
+    def _fit_layer(self, layer, X_new, y, splits=None, executor=None):
+        """Fit layer, one of the Layers of the Stack, on its input X_new as
+        the Stack does, out-of-fold on splits if cv is set, and return its
+        predictions for the next Layer"""
+        if self.cv is not None and not self.use_folds:
+            return layer.fit_oof(X_new, y, cv=splits, refit=self.refit,
+                                 executor=executor)
+        return layer.fit(X_new, y, executor=executor)
+
+    def _predict_input(self, X, idx):
+        """Input of the Layer idx when predicting X, i.e. the predictions
+        of the previous Layer, with the original features if passthrough"""
+        X_new = X
+        if self.passthrough:
+            blocks = self._passthrough_blocks(X)
+        for layer_idx in range(idx):
+            if self.passthrough and layer_idx > 0:
+                X_new = blocks.combine(X_new, layer_idx % 2)
+            X_new = self.layers[layer_idx].predict(X_new)
+        if self.passthrough and idx > 0:
+            X_new = blocks.combine(X_new, idx % 2)
+        return X_new
+
+    def partial_fit(self, X, y, classes=None, buffer_size=None):
+        """Update every Layer with a new batch (X, y) and return the fitted
+        Stack. Each Layer is updated with the predictions of the previous
+        Layer on the batch, after its own update, see Layer.partial_fit.
+        The folds and cv options of the Stack are not used: all the Layers
+        learn from every batch.
+
+        Parameters
+        ==========
+        X : array-like or sparse matrix, shape (n_samples, n_features)
+            Training data of the batch
+        y : array_like, shape (n_samples, n_targets)
+            Target values of the batch.
+        classes : array-like, optional
+            All the classes of y, required by the partial_fit of the
+            classifiers on the first batch.
+        buffer_size : int, optional
+            Number of most recent rows kept to fit again the models without
+            partial_fit, all rows if None.
+
+        Returns
+        =======
+        self : object, the updated Stack itself
+        """
+        start_time = perf_counter()
+        if self._output_cache is not None:
+            # the cached predictions are out of date
+            self._output_cache.reset(None)
+        if self.row_cache is not None:
+            self.row_cache.clear()
+        X_new = X
+        blocks = {}
+        layer_reports = []
+        for idx in range(self.depth):
+            if self.passthrough and idx > 0:
+                X_new = self._with_passthrough(idx, None, X_new, X, blocks,
+                                               fit=True)
+            X_new = self.layers[idx].partial_fit(X_new, y, classes=classes,
+                                                 buffer_size=buffer_size)
+            layer_reports.append(self.layers[idx].report)
+        self._make_report('partial_fit', start_time, _num_samples(X),
+                          layer_reports)
+        return self
+
+    def _make_report(self, method, start_time, n_samples, layer_reports,
+                     **extra):
+        """Set the report of the last call, with the items of extra, and
+        pass it to the callbacks"""
+        elapsed = perf_counter() - start_time
+        self.report = {'event': 'stack', 'method': method,
+                       'n_samples': n_samples, 'time': elapsed,
+                       'rows_per_sec': _rate(n_samples, elapsed),
+                       'layers': layer_reports}
+        self.report.update(extra)
+        for callback in self.callbacks:
+            callback(self.report)
+
+    def _layer_input(self, idx, fold_idx, X, blocks, fit=False):
+        """Training data of the Layer idx on the fold fold_idx (None for all
+        the data), i.e. the predictions of the previous Layer, which are
+        taken from the cache or computed and cached, with the original
+        features if passthrough. blocks is a dict of the passthrough buffer
+        of each fold, fit is True if the Layer idx will be fitted on it"""
+        if fold_idx is None:
+            X_fold = X
+        else:
+            X_fold = _take_rows(X, self.folds[fold_idx])
+        if idx == 0:
+            return X_fold
+
+        key = (idx - 1, fold_idx)
+        if self._output_cache is not None and key in self._output_cache:
+            result = self._output_cache.get(key)
+        elif fold_idx is None and self.cv is not None:
+            raise ValueError("""The out-of-fold predictions of Layer {} are
+                not cached, fit the Stack from the start""".format(idx - 1))
+        else:
+            result = self.layers[idx - 1].predict(
+                self._layer_input(idx - 1, fold_idx, X, blocks))
+            if self._output_cache is not None:
+                result = self._output_cache.put(key, result)
+        if self.passthrough:
+            result = self._with_passthrough(idx, fold_idx, result, X_fold,
+                                            blocks, fit)
+        return result
+
+    def _with_passthrough(self, idx, fold_idx, X_new, X, blocks, fit=False):
+        """Put the predictions X_new of the previous Layer next to the
+        original features X for the Layer idx"""
+        if fold_idx not in blocks:
+            blocks[fold_idx] = _ColumnBlocks(X)
+        return blocks[fold_idx].combine(X_new, idx % 2, lock=fit)
+
+    def predict(self, X, out=None):
         """With given X, predict the result with the Stack
 
         Parameters
         ==========
         X : array-like or sparse matrix, shape (n_samples, n_features)
             Samples.
+        out : array, shape (n_samples,) or (n_samples, n_outputs), optional
+            If given, the predictions of the last Layer are written directly
+            in it instead of a newly allocated array.
 
         Returns
         =======
         C : array, shape (n_samples,)
             Returns predicted values from the Stack.
         """
+        if self.row_cache is not None and _is_row_cacheable(X):
+            return self._predict_cached(X, out)
+        return self._predict(X, out)
+
+    def _predict_cached(self, X, out=None):
+        """predict the rows of X not in the row cache only, and merge them
+        with the cached predictions"""
+        keys = self.row_cache.keys(X)
+        values = self.row_cache.get_many(keys)
+        # rows repeated within X are predicted once
+        missing = {}
+        for idx, (key, value) in enumerate(zip(keys, values)):
+            if value is None:
+                missing.setdefault(key, []).append(idx)
+        if missing:
+            rows = [indices[0] for indices in missing.values()]
+            predictions = self._predict(_take_rows(X, np.array(rows)))
+            predictions = [row.copy() for row in predictions]
+            self.row_cache.put_many(list(missing), predictions)
+            for indices, prediction in zip(missing.values(), predictions):
+                for idx in indices:
+                    values[idx] = prediction
+        result = np.array(values)
+        if out is not None:
+            out[...] = result.reshape(out.shape)
+        return result
+
+    def _predict(self, X, out=None):
+        start_time = perf_counter()
+        if out is not None and out.ndim == 1:
+            out = out.reshape(-1, 1)
         X_new = X
+        layer_reports = []
+        if self.passthrough:
+            blocks = self._passthrough_blocks(X)
         for idx in range(self.depth):
-            X_new = self.layers[idx].predict(X_new)
+            if self.passthrough and idx > 0:
+                X_new = blocks.combine(X_new, idx % 2)
+            if idx == self.depth - 1:
+                X_new = self.layers[idx].predict(X_new, out=out)
+            else:
+                X_new = self.layers[idx].predict(X_new)
+            layer_reports.append(self.layers[idx].report)
+        self._make_report('predict', start_time, X_new.shape[0],
+                          layer_reports)
         # flatten result if only a number for each X
         if X_new.shape[1] == 1:
             X_new = X_new.flatten()
         return X_new
 
-    def copy(self):
+    async def apredict(self, X, out=None, executor=None):
+        """Same as predict, as a coroutine for asyncio: the models of each
+        Layer are run concurrently in an executor and awaited, see
+        Layer.apredict, so a single process serves many requests at once
+        without blocking its event loop.
+
+        Parameters
+        ==========
+        X : array-like or sparse matrix, shape (n_samples, n_features)
+            Samples.
+        out : array, shape (n_samples,) or (n_samples, n_outputs), optional
+            See predict.
+        executor : concurrent.futures.Executor, optional
+            Where the models are run, by default the pool of open_pool if
+            opened or else the default executor of the event loop.
+
+        Returns
+        =======
+        C : array, shape (n_samples,)
+            Returns predicted values from the Stack.
+        """
+        start_time = perf_counter()
+        if out is not None and out.ndim == 1:
+            out = out.reshape(-1, 1)
+        X_new = X
+        layer_reports = []
+        if self.passthrough:
+            blocks = self._passthrough_blocks(X)
+        for idx in range(self.depth):
+            if self.passthrough and idx > 0:
+                X_new = blocks.combine(X_new, idx % 2)
+            X_new = await self.layers[idx].apredict(
+                X_new, out=out if idx == self.depth - 1 else None,
+                executor=executor)
+            layer_reports.append(self.layers[idx].report)
+        self._make_report('predict', start_time, X_new.shape[0],
+                          layer_reports)
+        if X_new.shape[1] == 1:
+            X_new = X_new.flatten()
+        return X_new
+
+    def _passthrough_blocks(self, X):
+        """Buffer of X with room for the widest predictions on each side"""
+        widths = [0, 0]
+        for idx in range(self.depth - 1):
+            side = (idx + 1) % 2
+            # the layout of Layers of models fitted elsewhere is only known
+            # after their first predict, the buffer then grows as needed
+            n_outputs = self.layers[idx].n_outputs or 0
+            widths[side] = max(widths[side], n_outputs)
+        return _ColumnBlocks(X, widths)
+
+    def predict_iter(self, X, chunk_size=None):
+        """Predict chunk by chunk with the Stack, yielding the predictions of
+        each chunk, so only one chunk of intermediate predictions is in
+        memory at a time.
+
+        Parameters
+        ==========
+        X : array-like, sparse matrix or np.memmap, or an iterable of those
+            If chunk_size is given, the samples to be split into chunks of
+            chunk_size rows, slicing a np.memmap only reads the rows of one
+            chunk from disk. If chunk_size is None, an iterable (e.g. a
+            generator) of batches of samples.
+        chunk_size : int or None
+            Number of rows in each chunk.
+
+        Yields
+        ======
+        C : array, shape (n_samples_in_chunk,)
+            Predicted values of each chunk from the Stack.
+        """
+        if chunk_size is None:
+            for batch in X:
+                yield self.predict(batch)
+        else:
+            X = _as_row_indexable(X)
+            for start, stop in _chunk_bounds(_num_samples(X), chunk_size):
+                yield self.predict(_take_rows(X, slice(start, stop)))
+
+    def predict_chunked(self, X, chunk_size=10000, out=None):
+        """Predict X with the Stack chunk by chunk, writing the predictions of
+        each chunk directly into out, so memory usage is bounded by
+        chunk_size and not by the number of samples.
+
+        Parameters
+        ==========
+        X : array-like, sparse matrix or np.memmap,
+            shape (n_samples, n_features)
+            Samples, slicing a np.memmap only reads one chunk from disk.
+        chunk_size : int
+            Number of rows predicted at a time.
+        out : array or np.memmap, shape (n_samples,) or
+              (n_samples, n_outputs), optional
+            Where to write the predictions, e.g. a np.memmap opened with
+            mode 'w+' to write them straight to disk.
+            If None, a new array is allocated.
+
+        Returns
+        =======
+        C : array, shape (n_samples,)
+            Returns predicted values from the Stack, out if given.
+        """
+        X = _as_row_indexable(X)
+        n_samples = _num_samples(X)
+        for start, stop in _chunk_bounds(n_samples, chunk_size):
+            chunk = _take_rows(X, slice(start, stop))
+            if out is None:
+                result = self.predict(chunk)
+                out = np.empty((n_samples,) + result.shape[1:],
+                               dtype=result.dtype)
+                out[start:stop] = result
+            else:
+                self.predict(chunk, out=out[start:stop])
+        return out
+
+    def predict_cascade(self, X, exits):
+        """Predict X with the Stack as a cascade: after each Layer, the rows
+        decided confidently enough by its predictions, according to its exit
+        criterion, exit with their prediction, and only the other rows go
+        through the next Layers. The report has the exit_rates, the fraction
+        of the rows exiting after each Layer (the last one included).
+
+        Parameters
+        ==========
+        X : array-like or sparse matrix, shape (n_samples, n_features)
+            Samples.
+        exits : list
+            The exit criterion of each Layer but the last one, or None for
+            no exit after the Layer, e.g. a picknmix.cascade.ProbaThreshold.
+            A criterion is called with the Layer and its predictions, and
+            returns a boolean array of the rows exiting and their
+            predictions, one value per row, so the last Layer must predict
+            one column.
+
+        Returns
+        =======
+        C : array, shape (n_samples,)
+            Returns predicted values from the Stack.
+        """
+        if len(exits) != self.depth - 1:
+            raise ValueError("There are {} exits but {} layers, expected one "
+                             "exit per layer but the last".format(
+                                 len(exits), self.depth))
+        n_outputs = self.layers[-1].n_outputs
+        if n_outputs not in (None, 1) and any(criterion is not None
+                                              for criterion in exits):
+            raise ValueError(
+                "The last Layer predicts {} columns, the rows exiting the "
+                "cascade early are predicted one value each, use a last "
+                "Layer predicting one column".format(n_outputs))
+        start_time = perf_counter()
+        X = _as_row_indexable(X)
+        n_samples = _num_samples(X)
+        # original rows of X still in the cascade, and their features
+        rows = np.arange(n_samples)
+        X_rows = X
+        X_new = X
+        exited_rows = []
+        exited_predictions = []
+        exit_counts = [0] * self.depth
+        layer_reports = []
+        for idx in range(self.depth):
+            if self.passthrough and idx > 0:
+                X_new = self._passthrough_blocks(X_rows).combine(X_new,
+                                                                 idx % 2)
+            X_new = self.layers[idx].predict(X_new)
+            layer_reports.append(self.layers[idx].report)
+            if idx == self.depth - 1:
+                if X_new.shape[1] == 1:
+                    X_new = X_new.flatten()
+                exited_rows.append(rows)
+                exited_predictions.append(X_new)
+                exit_counts[idx] = len(rows)
+            elif exits[idx] is not None:
+                exiting, predictions = exits[idx](self.layers[idx], X_new)
+                exited_rows.append(rows[exiting])
+                exited_predictions.append(predictions)
+                exit_counts[idx] = len(predictions)
+                remaining = np.flatnonzero(~exiting)
+                rows = rows[remaining]
+                if len(rows) == 0:
+                    break
+                X_rows = _take_rows(X_rows, remaining)
+                X_new = _take_rows(X_new, remaining)
+
+        if len({np.ndim(pred) for pred in exited_predictions}) > 1:
+            raise ValueError("The predictions of the exits and of the last "
+                             "Layer do not have the same shape")
+        predictions = np.concatenate(exited_predictions)
+        result = np.empty_like(predictions)
+        result[np.concatenate(exited_rows)] = predictions
+        self._make_report('predict_cascade', start_time, n_samples,
+                          layer_reports, exit_rates=[
+                              count / n_samples if n_samples else 0.0
+                              for count in exit_counts])
+        return result
+
+    def copy(self, fitted=False):
         """Copies the Stack's shape as it has not been trained before
+
+        Parameters
+        ==========
+        fitted : bool
+            If True, the copy shares the fitted models of the Stack, without
+            copying them, and can predict right away. They are only copied
+            when the copy is fitted (copy-on-write), see Layer.copy.
+
         Returns
         =======
         the copy of the Stack
         """
-        copyLayers = []
-        for idx in range(self.depth):
-            copyLayers.append(self.layers[idx].copy())
-        return Stack(layers=copyLayers)
+        stack = Stack(layers=self.layers, n_jobs=self.n_jobs,
+                      backend=self.backend, dtype=self.dtype, cv=self.cv,
+                      refit=self.refit, cache_outputs=self.cache_outputs,
+                      cache_dir=self.cache_dir, callbacks=self.callbacks,
+                      passthrough=self.passthrough,
+                      ownership='share' if fitted else 'clone',
+                      row_cache=None if self.row_cache is None else
+                      RowPredictionCache(self.row_cache.max_size,
+                                         self.row_cache.ttl))
+        if fitted:
+            stack.use_folds = self.use_folds
+            stack.folds = self.folds
+            stack.splitter = self.splitter
+        return stack
+
+    def save(self, path):
+        """Save the Stack to the directory path: a versioned manifest, the
+        Stack without its models, and each model and preprocessor in its own
+        file, with its large NumPy arrays stored raw next to it so they can
+        be memory mapped when loaded. A previously saved model in path is
+        replaced. The callbacks are not saved.
+
+        Parameters
+        ==========
+        path : str
+        """
+        self.warm_up()
+        persist.save(self, path)
+
+    @staticmethod
+    def load(path, mmap_mode='r', lazy=False):
+        """Load a Stack saved with Stack.save
+
+        Parameters
+        ==========
+        path : str
+        mmap_mode : str or None
+            'r' (default) memory maps the large arrays read-only, so the
+            processes loading the same Stack share them; 'c' maps them copy
+            on write and None reads them into memory.
+        lazy : bool
+            If True, each model and preprocessor is only loaded when its
+            Layer first predicts or is fitted, or by Stack.warm_up, so a
+            worker starts without reading the Layers it does not use. The
+            directory must be kept until then.
+
+        Returns
+        =======
+        the Stack
+        """
+        return _load_as(Stack, path, mmap_mode, lazy)
+
+    def warm_up(self, layers=None):
+        """Load the models and preprocessors of a Stack loaded lazily now
+        rather than on first use, and return the Stack
+
+        Parameters
+        ==========
+        layers : list of int, optional
+            Indices of the Layers to load, all of them if None.
+        """
+        if layers is None:
+            layers = range(self.depth)
+        for idx in layers:
+            self.layers[idx].warm_up()
+        return self
+
+    def compile(self):
+        """Resolve the fitted Stack into a flat execution plan for fast
+        prediction of small batches, e.g. online requests. Which method of
+        each model to call, which preprocessors are shared, where the
+        predictions of each model go and their data types are all decided
+        once, so predicting costs little more than calling the models.
+        The plan predicts serially, without reports, callbacks or pools.
+        Compile again after fitting the Stack again.
+
+        Returns
+        =======
+        compiled : CompiledStack
+        """
+        return CompiledStack(self.warm_up())
+
+
+class CompiledStack:
+    def __init__(self, stack):
+        """Flat execution plan of a fitted Stack, see Stack.compile
+
+        Parameters
+        ==========
+        stack : a fitted Stack
+        """
+        steps = []
+        for layer in stack.layers:
+            if layer.output_widths is None:
+                raise ValueError("Stack must be fitted before compiling")
+            steps.append(_compile_layer(layer))
+        self._steps = tuple(steps)
+        self.depth = len(steps)
+        self.passthrough = stack.passthrough
+        # room for the widest predictions on each side of the features
+        widths = [0, 0]
+        for idx, layer in enumerate(stack.layers[:-1]):
+            side = (idx + 1) % 2
+            widths[side] = max(widths[side], layer.n_outputs)
+        self._widths = tuple(widths)
+
+    def predict(self, X):
+        """With given X, predict the result with the compiled Stack
+
+        Parameters
+        ==========
+        X : array-like or sparse matrix, shape (n_samples, n_features)
+            Samples.
+
+        Returns
+        =======
+        C : array, shape (n_samples,)
+            Returns predicted values from the Stack.
+        """
+        X_new = X
+        if self.passthrough:
+            blocks = _ColumnBlocks(X, self._widths)
+        for idx, step in enumerate(self._steps):
+            if self.passthrough and idx > 0:
+                X_new = blocks.combine(X_new, idx % 2)
+            X_new = _run_compiled_layer(step, X_new)
+        if X_new.shape[1] == 1:
+            X_new = X_new.flatten()
+        return X_new
+
+
+# Execution plan of a fitted Layer: transforms are the transform methods of
+# the distinct preprocessors, members are (transform index or -1, predict
+# method, columns) for each model, n_features_in is not None with
+# passthrough, and promote is True if the dtype of the output must be
+# promoted with the one of the features passed through. Layers which
+# average the models of each fold have a fallback, Layer.predict.
+_LayerPlan = namedtuple('_LayerPlan', ['transforms', 'members', 'n_outputs',
+                                       'dtype', 'n_features_in', 'promote',
+                                       'fallback'])
+
+
+def _compile_layer(layer):
+    """Return the _LayerPlan of a fitted Layer"""
+    if layer.fold_layers is not None:
+        return _LayerPlan((), (), layer.n_outputs, layer.output_dtype, None,
+                          False, layer.predict)
+
+    transforms = []
+    transform_index = {}
+    members = []
+    offset = layer.n_features_in if layer.passthrough else 0
+    for idx, width in enumerate(layer.output_widths):
+        preprocessor = layer.preprocessors[idx]
+        t_idx = -1
+        if preprocessor is not None:
+            if id(preprocessor) not in transform_index:
+                transform_index[id(preprocessor)] = len(transforms)
+                transforms.append(preprocessor.transform)
+            t_idx = transform_index[id(preprocessor)]
+
+        model = layer.models[idx]
+        if layer.predict_methods[idx] == 'predict_proba':
+            columns = slice(offset, offset + width)
+            method = model.predict_proba
+        else:
+            # a 1D prediction goes to one column
+            columns = offset
+            method = model.predict
+        members.append((t_idx, method, columns))
+        offset += width
+
+    n_features_in = layer.n_features_in if layer.passthrough else None
+    return _LayerPlan(tuple(transforms), tuple(members), layer.n_outputs,
+                      layer.output_dtype, n_features_in,
+                      layer.passthrough and layer.dtype is None, None)
+
+
+def _run_compiled_layer(step, X):
+    transforms, members, n_outputs, dtype, n_features_in, promote, \
+        fallback = step
+    if fallback is not None:
+        return fallback(X)
+    transformed = [transform(X) for transform in transforms]
+    sparse_passthrough = n_features_in is not None and _is_sparse(X)
+    if sparse_passthrough:
+        n_outputs -= n_features_in
+    elif promote:
+        dtype = np.result_type(_dtype_of(X), dtype)
+    out = np.empty((_num_samples(X), n_outputs), dtype=dtype)
+    for t_idx, method, columns in members:
+        if sparse_passthrough:
+            columns = _shift_columns(columns, -n_features_in)
+        out[:, columns] = method(X if t_idx < 0 else transformed[t_idx])
+    if sparse_passthrough:
+        sparse = importlib.import_module('scipy.sparse')
+        return sparse.hstack([X, sparse.csr_matrix(out)], format='csr')
+    if n_features_in is not None:
+        out[:, :n_features_in] = X
+    return out
+
+
+def _shift_columns(columns, shift):
+    if isinstance(columns, slice):
+        return slice(columns.start + shift, columns.stop + shift)
+    return columns + shift
+
+
+class _ColumnBlocks:
+    def __init__(self, X, widths=(0, 0)):
+        """The original features X next to the predictions of a Layer, for
+        Stack with passthrough. Dense X is copied once in a Fortran ordered
+        buffer with room for predictions on both sides, so that
+        [predictions, X] and [X, predictions] are both contiguous views of
+        the buffer. Successive Layers alternate between the two sides, so a
+        Layer writes its predictions on the side the previous Layer did not
+        read. Sparse X is concatenated with the predictions every time.
+
+        Parameters
+        ==========
+        X : array-like or sparse matrix, shape (n_samples, n_features)
+        widths : the room to make for predictions on the left and right
+        """
+        self.X = X
+        self.sparse = _is_sparse(X)
+        self._buffer = None
+        self._widths = list(widths)
+        # sides that Layers were fitted on, models (e.g. nearest neighbors)
+        # might keep a reference to the data, so it must not be overwritten
+        self._locked = [False, False]
+
+    def combine(self, X_new, side, lock=False):
+        """Return [X_new, X] if side is 0 or [X, X_new] if side is 1.
+        If lock is True, the side is not overwritten afterwards, a new buffer
+        is used instead."""
+        if self.sparse:
+            sparse = importlib.import_module('scipy.sparse')
+            blocks = [sparse.csr_matrix(X_new), self.X]
+            if side == 1:
+                blocks.reverse()
+            return sparse.hstack(blocks, format='csr')
+
+        width = X_new.shape[1]
+        dtype = np.result_type(_dtype_of(self.X), X_new.dtype)
+        if self._buffer is None or self._locked[side] or \
+                width > self._widths[side] or dtype != self._buffer.dtype:
+            widths = list(self._widths)
+            widths[side] = max(widths[side], width)
+            self._allocate(widths, dtype)
+
+        n_features = _num_features(self.X)
+        left = self._widths[0]
+        if side == 0:
+            start, stop = left - width, left + n_features
+            self._buffer[:, start:left] = X_new
+        else:
+            start, stop = left, left + n_features + width
+            self._buffer[:, left + n_features:stop] = X_new
+        if lock:
+            self._locked[side] = True
+        return self._buffer[:, start:stop]
+
+    def _allocate(self, widths, dtype):
+        n_features = _num_features(self.X)
+        self._widths = widths
+        self._buffer = np.empty(
+            (_num_samples(self.X), widths[0] + n_features + widths[1]),
+            dtype=dtype, order='F')
+        self._buffer[:, widths[0]:widths[0] + n_features] = self.X
+        self._locked = [False, False]
+
+
+OWNERSHIPS = ('copy', 'clone', 'share')
+
+
+def _load_as(cls, path, mmap_mode, lazy):
+    obj = persist.load(path, mmap_mode, lazy)
+    if not isinstance(obj, cls):
+        raise TypeError("{} holds a {}, not a {}".format(
+            path, type(obj).__name__, cls.__name__))
+    if lazy:
+        for layer in obj.layers if cls is Stack else [obj]:
+            layer._lazy = True
+    return obj
+
+
+def _loaded(member):
+    if isinstance(member, persist.LazyMember):
+        return member.load()
+    return member
+
+
+_sklearn_clone = None
+
+
+def _clone_estimator(estimator):
+    """Unfitted copy of an estimator, made from its parameters with
+    sklearn.base.clone if it has get_params, or a deep copy otherwise"""
+    global _sklearn_clone
+    if estimator is None:
+        return None
+    if hasattr(estimator, 'get_params') and not isinstance(estimator, type):
+        if _sklearn_clone is None:
+            try:
+                _sklearn_clone = importlib.import_module('sklearn.base').clone
+            except ImportError:
+                _sklearn_clone = _clone_from_params
+        return _sklearn_clone(estimator)
+    return deepcopy(estimator)
+
+
+def _clone_from_params(estimator):
+    params = estimator.get_params(deep=False)
+    for name, param in params.items():
+        if hasattr(param, 'get_params') and not isinstance(param, type):
+            params[name] = _clone_from_params(param)
+        else:
+            params[name] = deepcopy(param)
+    return type(estimator)(**params)
+
+
+def _fit_member(preprocessor, model, proba, X, y):
+    """Fit one preprocessor and model pair of a Layer, return them with the
+    predictions on X, as a 2D array, for the next Layer, and a dict of the
+    time spent in each stage"""
+    timing = {}
+    start_time = perf_counter()
+    if preprocessor is not None:
+        X_new = preprocessor.fit_transform(X)
+    else:
+        X_new = X
+    timing['preprocess'] = perf_counter() - start_time
+
+    start_time = perf_counter()
+    model.fit(X_new, y)
+    timing['fit'] = perf_counter() - start_time
+
+    start_time = perf_counter()
+    result = _model_predict(model, _prediction_method(model, proba), X_new)
+    timing['predict'] = perf_counter() - start_time
+    return preprocessor, model, result, timing
+
+
+def _preprocess(preprocessor, X, fit):
+    """Fit (if fit is True) and apply a preprocessor, return it with the
+    transformed X and the time spent"""
+    start_time = perf_counter()
+    if fit:
+        X_new = preprocessor.fit_transform(X)
+    else:
+        X_new = preprocessor.transform(X)
+    return preprocessor, X_new, perf_counter() - start_time
+
+
+def _predict_member(preprocessor, model, method, X, out=None):
+    """Predict X with one fitted preprocessor and model pair of a Layer,
+    using the method of the model named method,
+    return the predictions as a 2D array, or write them in out and
+    return None if out is given, with a dict of the time spent in each
+    stage"""
+    timing = {}
+    start_time = perf_counter()
+    if preprocessor is not None:
+        X_new = preprocessor.transform(X)
+    else:
+        X_new = X
+    timing['preprocess'] = perf_counter() - start_time
+
+    start_time = perf_counter()
+    result = _model_predict(model, method, X_new)
+    if out is not None:
+        out[...] = result
+        result = None
+    timing['predict'] = perf_counter() - start_time
+    return result, timing
+
+
+def _prediction_method(model, proba):
+    """Name of the method giving the predictions of a model for the next
+    Layer, predict is used if proba is True but predict_proba not exist"""
+    if proba and _method_checker(model, 'predict_proba'):
+        return 'predict_proba'
+    return 'predict'
+
+
+def _model_predict(model, method, X):
+    if method == 'predict_proba':
+        return model.predict_proba(X)
+    return np.expand_dims(model.predict(X), axis=1)
+
+
+def _cross_fit_member(preprocessor, model, proba, X_train, y_train, X_test):
+    """Fit one preprocessor and model pair on the training rows of a fold
+    and return them with the predictions on the test rows of the fold,
+    or None if X_test is None"""
+    preprocessor, model, result, timing = _fit_member(
+        preprocessor, model, proba, X_train, y_train)
+    if X_test is not None:
+        result, test_timing = _predict_member(
+            preprocessor, model, _prediction_method(model, proba), X_test)
+        for stage, elapsed in test_timing.items():
+            timing[stage] += elapsed
+    else:
+        result = None
+    return preprocessor, model, result, timing
+
+
+def _partial_fit_member(preprocessor, model, proba, X, y, classes, n_new):
+    """Update a model with partial_fit on (X, y), or if n_new is given, fit
+    a preprocessor and model pair again on (X, y), the buffered rows, and
+    return them with the predictions on the n_new last rows, the new batch,
+    and a dict of the time spent in each stage"""
+    if n_new is not None:
+        preprocessor, model, result, timing = _fit_member(
+            preprocessor, model, proba, X, y)
+        return preprocessor, model, result[-n_new:], timing
+
+    timing = {'preprocess': 0.0}
+    start_time = perf_counter()
+    if classes is not None and 'classes' in inspect.signature(
+            model.partial_fit).parameters:
+        model.partial_fit(X, y, classes=classes)
+    else:
+        model.partial_fit(X, y)
+    timing['fit'] = perf_counter() - start_time
+
+    start_time = perf_counter()
+    result = _model_predict(model, _prediction_method(model, proba), X)
+    timing['predict'] = perf_counter() - start_time
+    return preprocessor, model, result, timing
+
+
+def _cross_fit_member_rows(preprocessor, model, proba, X, y, train, test):
+    """_cross_fit_member on the rows train and test of (X, y), taken in the
+    worker, or on all of (X, y) without test predictions if train is None"""
+    if train is None:
+        return _cross_fit_member(preprocessor, model, proba, X, y, None)
+    return _cross_fit_member(preprocessor, model, proba, _take_rows(X, train),
+                             _take_rows(y, train), _take_rows(X, test))
+
+
+def _get_splits(cv, X, y):
+    """Return a list of (train, test) index arrays from cv, which could be
+    an int (number of contiguous folds), a cross-validator from sci-kit learn
+    or a list of (train, test) pairs"""
+    if isinstance(cv, int):
+        n_samples = _num_samples(X)
+        if cv < 2 or cv > n_samples:
+            raise ValueError("Cannot make {} folds with {} samples".format(
+                cv, n_samples))
+        indices = np.arange(n_samples)
+        splits = []
+        for test in np.array_split(indices, cv):
+            train = np.concatenate((indices[:test[0]], indices[test[-1] + 1:]))
+            splits.append((train, test))
+        return splits
+    if _method_checker(cv, 'split'):
+        return [(np.asarray(train), np.asarray(test))
+                for train, test in cv.split(X, y)]
+    return [(np.asarray(train), np.asarray(test)) for train, test in cv]
+
+
+def _check_partition(splits, n_samples):
+    counts = np.zeros(n_samples, dtype=int)
+    for _, test in splits:
+        counts[test] += 1
+    if not np.all(counts == 1):
+        raise ValueError("""The test sets of the folds must cover every
+            sample exactly once for out-of-fold predictions""")
+
+
+def _deepcopy_sharing_callbacks(obj, memo):
+    """Deep copy of a Layer or Stack sharing its callbacks, e.g. a
+    ReportCollector or a logger writing to a socket, with obj"""
+    for callback in obj.callbacks:
+        memo[id(callback)] = callback
+    result = obj.__class__.__new__(obj.__class__)
+    memo[id(obj)] = result
+    result.__dict__.update(deepcopy(obj.__getstate__(), memo))
+    return result
+
+
+def _data_token(X, y):
+    """Fingerprint of the content of the training data, so the cached
+    predictions are not reused once the data is modified in place"""
+    digest = hashlib.sha256()
+    for data in (X, y):
+        _update_digest(digest, data)
+    return digest.hexdigest()
+
+
+def _folds_token(folds):
+    return tuple(np.asarray(fold).tobytes() for fold in folds)
+
+
+def _load_if_path(X):
+    """Memory map X if it is the path of a .npy file"""
+    if isinstance(X, (str, os.PathLike)):
+        return np.load(X, mmap_mode='r')
+    return X
+
+
+def _as_slice(rows):
+    """Return rows as a slice if it is a contiguous increasing range of
+    indices, so taking them gives a view instead of a copy"""
+    if isinstance(rows, slice):
+        return rows
+    rows = np.asarray(rows)
+    if rows.ndim != 1 or rows.size == 0 or rows.dtype.kind not in 'iu':
+        return rows
+    start, stop = int(rows[0]), int(rows[-1]) + 1
+    if start >= 0 and stop - start == rows.size and \
+            np.all(np.diff(rows) == 1):
+        return slice(start, stop)
+    return rows
+
+
+def _is_sparse(X):
+    return hasattr(X, 'tocsr') and hasattr(X, 'nnz')
+
+
+def _as_row_indexable(X):
+    """Convert sparse matrices which cannot be indexed by rows (e.g. COO) to
+    CSR, other inputs are returned as they are"""
+    if _is_sparse(X) and X.format not in ('csr', 'csc', 'lil', 'dok'):
+        return X.tocsr()
+    return X
+
+
+def _take_rows(X, rows):
+    """Take rows of X, which are a view of X when rows are contiguous,
+    and falls back to indexed gathering (a copy) otherwise. Sparse matrices
+    are never densified"""
+    rows = _as_slice(rows)
+    if hasattr(X, 'iloc'):
+        return X.iloc[rows]
+    if isinstance(X, list):
+        X = np.asarray(X)
+    return X[rows]
+
+
+def _chunk_bounds(n_samples, chunk_size):
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be positive, got {}".format(
+            chunk_size))
+    return [(start, min(start + chunk_size, n_samples))
+            for start in range(0, n_samples, chunk_size)]
+
+
+def _rate(n_samples, elapsed):
+    if elapsed <= 0:
+        return float('inf')
+    return n_samples / elapsed
+
+
+def _num_features(X):
+    if hasattr(X, 'shape'):
+        return X.shape[1]
+    return len(X[0])
+
+
+def _dtype_of(X):
+    if hasattr(X, 'dtype'):
+        return X.dtype
+    return np.asarray(X).dtype
+
+
+def _nbytes(X):
+    if _is_sparse(X):
+        X = X.tocsr()
+        return X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+    return X.nbytes
+
+
+def _num_samples(X):
+    if hasattr(X, 'shape'):
+        return X.shape[0]
+    return len(X)
+
+
+def _is_row_cacheable(X):
+    """Whether the rows of X can be keyed by their bytes, see
+    RowPredictionCache"""
+    if _is_sparse(X):
+        return False
+    if hasattr(X, 'dtypes'):
+        return all(dtype.kind in 'biuf' for dtype in X.dtypes)
+    return isinstance(X, np.ndarray) and X.dtype.kind in 'biuf'
+
+
+def _concat_rows(parts):
+    """Concatenate the rows of arrays, sparse matrices or DataFrames"""
+    if len(parts) == 1:
+        return parts[0]
+    if _is_sparse(parts[0]):
+        sparse = importlib.import_module('scipy.sparse')
+        return sparse.vstack(parts, format='csr')
+    if hasattr(parts[0], 'iloc'):
+        return importlib.import_module('pandas').concat(parts)
+    return np.concatenate([np.asarray(part) for part in parts])
 
 
 def _method_checker(obj, method_name):
-    return method_name in dir(obj)
+    return callable(getattr(obj, method_name, None))
 
 
 def _check_custom_folds(obj):
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+"""Search of the best Stack among combinations of Layers, fitting the Layers
+shared by several combinations once."""
+
+import itertools
+import importlib
+from time import perf_counter
+import numpy as np
+
+from .parallel import parallel_map, check_backend
+from .picknmix import (Layer, Stack, _as_row_indexable, _load_if_path,
+                       _take_rows, _get_splits)
+
+
+class StackSearch:
+    def __init__(self, space, scoring=None, n_iter=None, random_state=None,
+                 n_jobs=None, backend='threading', stack_params=None):
+        """Search the combination of Layers making the best Stack, scored
+        on validation data.
+
+        The candidates are grouped by their prefix, the Layers before the
+        last one: each prefix is fitted once, starting from the fitted Layers
+        it shares with a prefix fitted before (see Stack.fit start_layer),
+        and its predictions are reused to fit all the last Layers of its
+        candidates, concurrently. So trying 200 last Layers on the same
+        prefix costs one fit of the prefix.
+
+        Parameters
+        ==========
+        space : list
+            One entry per Layer of the Stacks: a Layer, or a list of the
+            Layers to try at this position.
+        scoring : callable, optional
+            scoring(y_true, y_pred) gives the score of a Stack, the higher
+            the better. By default the accuracy if the first model of the
+            last Layer is a classifier, the R2 score otherwise.
+        n_iter : int, optional
+            If given, only n_iter combinations drawn at random are tried.
+        random_state : int, optional
+            Seed of the draw of n_iter combinations.
+        n_jobs, backend:
+            How the last Layers of a prefix are fitted concurrently, see
+            Layer.
+        stack_params : dict, optional
+            Options of the Stacks, e.g. folds, cv or passthrough. Their
+            cache_outputs is True.
+        """
+        check_backend(backend)
+        self.space = [[option] if isinstance(option, Layer) else list(option)
+                      for option in space]
+        self.scoring = scoring
+        self.n_iter = n_iter
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+        self.backend = backend
+        self.stack_params = {} if stack_params is None else dict(stack_params)
+        self.stack_params.setdefault('cache_outputs', True)
+        if not self.stack_params['cache_outputs']:
+            raise ValueError("StackSearch needs the cache_outputs of Stack")
+        # set by fit
+        self.results_ = None
+        self.best_index_ = None
+        self.best_score_ = None
+        self.best_stack_ = None
+        self.n_prefix_fits_ = None
+
+    def candidates(self):
+        """The combinations tried, as tuples of the index of the Layer at
+        each position of space"""
+        sizes = [len(options) for options in self.space]
+        n_candidates = int(np.prod(sizes))
+        if self.n_iter is None or self.n_iter >= n_candidates:
+            return list(itertools.product(*[range(size) for size in sizes]))
+        rng = np.random.RandomState(self.random_state)
+        candidates = []
+        for number in rng.choice(n_candidates, self.n_iter, replace=False):
+            candidate = []
+            for size in reversed(sizes):
+                number, option = divmod(int(number), size)
+                candidate.append(option)
+            candidates.append(tuple(reversed(candidate)))
+        return candidates
+
+    def fit(self, X, y, X_valid, y_valid):
+        """Fit and score every candidate, and keep the best Stack
+
+        Parameters
+        ==========
+        X : array-like or sparse matrix, shape (n_samples, n_features)
+            Training data, see Stack.fit
+        y : array_like, shape (n_samples, n_targets)
+            Target values.
+        X_valid, y_valid :
+            Validation data the candidates are scored on.
+
+        Returns
+        =======
+        self : object, with results_, a dict per candidate with its score
+               and the time spent fitting its last Layer, best_index_,
+               best_score_, best_stack_ and n_prefix_fits_, the number of
+               prefixes fitted.
+        """
+        X = _as_row_indexable(_load_if_path(X))
+        y = _load_if_path(y)
+        scoring = self.scoring
+        if scoring is None:
+            scoring = _default_scoring(self.space[-1][0].models[0])
+        candidates = self.candidates()
+        by_prefix = {}
+        for candidate_idx, candidate in enumerate(candidates):
+            by_prefix.setdefault(candidate[:-1], []).append(candidate_idx)
+
+        depth = len(self.space)
+        fitted = {}
+        results = [None] * len(candidates)
+        best = None
+        for prefix in sorted(by_prefix):
+            candidate_indices = by_prefix[prefix]
+            # the first candidate is fitted along with the prefix
+            first = candidates[candidate_indices[0]]
+            stack, start_layer = self._prefix_stack(fitted, first)
+            start_time = perf_counter()
+            stack.fit(X, y, start_layer=start_layer)
+            first_time = perf_counter() - start_time
+            fitted[prefix] = stack
+
+            if stack.use_folds:
+                X_last = stack._layer_input(depth - 1, depth - 1, X, {},
+                                            fit=True)
+                y_last = _take_rows(y, stack.folds[depth - 1])
+                splits = None
+            else:
+                X_last = stack._layer_input(depth - 1, None, X, {}, fit=True)
+                y_last = y
+                splits = None
+                if stack.cv is not None:
+                    splits = _get_splits(stack.cv, X, y)
+            X_valid_last = stack._predict_input(X_valid, depth - 1)
+
+            layers = [stack.layers[-1]]
+            scores = [_score_layer(stack.layers[-1], X_valid_last, y_valid,
+                                   scoring)]
+            times = [first_time]
+            tasks = [(stack, self.space[-1][candidates[idx][-1]], X_last,
+                      y_last, splits, X_valid_last, y_valid, scoring)
+                     for idx in candidate_indices[1:]]
+            for layer, score, fit_time in parallel_map(
+                    _fit_candidate, tasks, n_jobs=self.n_jobs,
+                    backend=self.backend):
+                layers.append(layer)
+                scores.append(score)
+                times.append(fit_time)
+
+            for candidate_idx, layer, score, fit_time in zip(
+                    candidate_indices, layers, scores, times):
+                results[candidate_idx] = {'candidate': candidates[
+                    candidate_idx], 'score': score, 'fit_time': fit_time}
+                if best is None or score > best[0]:
+                    best = (score, candidate_idx, stack, layer)
+
+        self.results_ = results
+        self.best_score_, self.best_index_, stack, layer = best
+        self.best_stack_ = stack.copy(fitted=True)
+        self.best_stack_.layers[-1] = layer
+        self.n_prefix_fits_ = len(by_prefix)
+        return self
+
+    def predict(self, X):
+        """Predict X with the best Stack"""
+        return self.best_stack_.predict(X)
+
+    def _prefix_stack(self, fitted, candidate):
+        """A Stack of candidate and the index of its first Layer to fit:
+        it shares the fitted Layers, and their cached predictions, of the
+        fitted prefix with the most Layers in common with candidate"""
+        n_common, nearest = 0, None
+        for prefix, stack in fitted.items():
+            common = 0
+            while common < len(prefix) and \
+                    prefix[common] == candidate[common]:
+                common += 1
+            if common > n_common:
+                n_common, nearest = common, stack
+        if nearest is None:
+            return Stack([options[idx] for options, idx in
+                          zip(self.space, candidate)],
+                         **self.stack_params), 0
+
+        stack = nearest.copy(fitted=True)
+        if nearest._output_cache is not None:
+            stack._output_cache = nearest._output_cache.fork()
+        for layer_idx in range(n_common, len(candidate)):
+            stack.layers[layer_idx] = self.space[layer_idx][
+                candidate[layer_idx]].copy()
+        return stack, n_common
+
+
+def _fit_candidate(stack, layer, X, y, splits, X_valid, y_valid, scoring):
+    """Fit a copy of layer as the last Layer of stack on its input (X, y)
+    and return it with its score on the validation data and the time spent
+    fitting it"""
+    layer = layer.copy()
+    start_time = perf_counter()
+    stack._fit_layer(layer, X, y, splits)
+    fit_time = perf_counter() - start_time
+    return layer, _score_layer(layer, X_valid, y_valid, scoring), fit_time
+
+
+def _score_layer(layer, X_valid, y_valid, scoring):
+    y_pred = layer.predict(X_valid)
+    if y_pred.shape[1] == 1:
+        y_pred = y_pred.flatten()
+    return scoring(y_valid, y_pred)
+
+
+def _default_scoring(model):
+    base = importlib.import_module('sklearn.base')
+    metrics = importlib.import_module('sklearn.metrics')
+    if base.is_classifier(model):
+        return metrics.accuracy_score
+    return metrics.r2_score
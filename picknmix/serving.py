@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+"""Helpers for serving a fitted Stack online."""
+
+import queue
+import asyncio
+import threading
+from time import perf_counter
+from concurrent.futures import Future
+
+from .picknmix import _concat_rows, _num_samples
+
+_STOP = object()
+
+
+class MicroBatcher:
+    def __init__(self, model, max_batch_size=64, max_wait=0.005):
+        """Coalesce the requests of many callers, e.g. single rows, into
+        batches predicted with one call of model.predict, as predicting a
+        batch costs little more than predicting a row. A request waits at
+        most max_wait seconds for others to join its batch.
+
+        The batches are predicted by a background thread, started here and
+        stopped by close (or at the end of a with block).
+
+        Parameters
+        ==========
+        model : Stack, CompiledStack or Layer
+            Any fitted model with a predict method.
+        max_batch_size : int
+            A batch is predicted as soon as it has this many rows.
+        max_wait : float
+            Seconds the first request of a batch waits for other requests.
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        # number of batches predicted and of the requests in them
+        self.n_batches = 0
+        self.n_requests = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='picknmix-microbatcher')
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, X):
+        """Queue the samples X, usually a few rows, and return a
+        concurrent.futures.Future of their predictions"""
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The MicroBatcher is closed")
+            self._queue.put((X, future))
+        return future
+
+    def predict(self, X, timeout=None):
+        """Predictions of the samples X, predicted in a batch with the
+        requests of other threads"""
+        return self.submit(X).result(timeout)
+
+    async def apredict(self, X):
+        """Predictions of the samples X, awaited in asyncio"""
+        return await asyncio.wrap_future(self.submit(X))
+
+    def close(self):
+        """Predict the requests queued and stop the background thread"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            request = self._queue.get()
+            if request is _STOP:
+                break
+            batch = [request]
+            n_rows = _num_samples(request[0])
+            deadline = perf_counter() + self.max_wait
+            while n_rows < self.max_batch_size:
+                timeout = deadline - perf_counter()
+                try:
+                    if timeout > 0:
+                        request = self._queue.get(timeout=timeout)
+                    else:
+                        request = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is _STOP:
+                    stop = True
+                    break
+                batch.append(request)
+                n_rows += _num_samples(request[0])
+            self._predict_batch(batch)
+
+    def _predict_batch(self, batch):
+        futures = [future for _, future in batch
+                   if future.set_running_or_notify_cancel()]
+        if not futures:
+            return
+        batch = [(X, future) for X, future in batch if future in futures]
+        try:
+            sizes = [_num_samples(X) for X, _ in batch]
+            result = self.model.predict(_concat_rows([X for X, _ in batch]))
+        except BaseException as exc:
+            for future in futures:
+                future.set_exception(exc)
+            return
+        self.n_batches += 1
+        self.n_requests += len(batch)
+        start = 0
+        for size, (_, future) in zip(sizes, batch):
+            future.set_result(result[start:start + size])
+            start += size
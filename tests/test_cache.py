@@ -0,0 +1,185 @@
+import os
+import pytest
+import numpy as np
+from sklearn.linear_model import LinearRegression
+from sklearn.preprocessing import MinMaxScaler
+from picknmix import Layer, Stack
+from picknmix.cache import LayerOutputCache, MemberCache, RowPredictionCache
+
+
+class CountingRegression(LinearRegression):
+    n_predict = 0
+    n_fit = 0
+
+    def fit(self, X, y):
+        CountingRegression.n_fit += 1
+        return super().fit(X, y)
+
+    def predict(self, X):
+        CountingRegression.n_predict += 1
+        return super().predict(X)
+
+
+class TestLayerOutputCache:
+    def test_put_get_and_invalidate(self):
+        cache = LayerOutputCache()
+        cache.reset('data')
+        cache.put((0, 1), np.ones((2, 1)))
+        cache.put((1, 2), np.ones((2, 1)))
+        assert (0, 1) in cache
+        cache.invalidate(1)
+        assert (1, 2) not in cache
+        cache.reset('data')
+        assert len(cache) == 1
+        cache.reset('other data')
+        assert len(cache) == 0
+
+    def test_spill_to_disk(self, tmp_path):
+        cache = LayerOutputCache(str(tmp_path))
+        value = cache.put((0, None), np.arange(4.).reshape(2, 2))
+        assert isinstance(value, np.memmap)
+        assert np.array_equal(cache.get((0, None)), [[0, 1], [2, 3]])
+        cache.clear()
+        assert list(tmp_path.iterdir()) == []
+
+    def test_stack_reuses_cached_outputs(self, tmp_path):
+        X = np.array([[1, 1], [1, 2], [2, 2], [2, 3], [3, 1], [3, 2]])
+        y = np.dot(X, np.array([1, 2])) + 3
+        model = Stack([Layer([CountingRegression()]),
+                       Layer([LinearRegression()], [MinMaxScaler()]),
+                       Layer([LinearRegression()])],
+                      folds=[[0, 1], [2, 3], [4, 5]],
+                      cache_outputs=True, cache_dir=str(tmp_path))
+        CountingRegression.n_predict = 0
+        model.fit(X, y)
+        # once in fit, then once on fold 1 and once on fold 2
+        assert CountingRegression.n_predict == 3
+        model.fit(X, y, start_layer=2)
+        assert CountingRegression.n_predict == 3
+        result = model.predict(np.array([[3, 5]]))
+        assert np.allclose(result, np.array([16]))
+
+    def test_stack_refits_on_modified_data(self):
+        X = np.array([[1, 1], [1, 2], [2, 2], [2, 3], [3, 1], [3, 2]])
+        y = np.dot(X, np.array([1, 2])) + 3
+        model = Stack([Layer([CountingRegression()]),
+                       Layer([LinearRegression()])], cache_outputs=True)
+        CountingRegression.n_predict = 0
+        model.fit(X, y)
+        assert CountingRegression.n_predict == 1
+        X[:] = X * 2
+        model.fit(X, y, start_layer=1)
+        # the data changed, the first Layer predicts it again
+        assert CountingRegression.n_predict == 2
+
+    def test_stack_does_not_cache_last_layer(self):
+        X = np.array([[1, 1], [1, 2], [2, 2], [2, 3]])
+        y = np.dot(X, np.array([1, 2])) + 3
+        model = Stack([Layer([LinearRegression()]),
+                       Layer([LinearRegression()])], cache_outputs=True)
+        model.fit(X, y)
+        assert (0, None) in model._output_cache
+        assert (1, None) not in model._output_cache
+        assert Stack([Layer([LinearRegression()])])._output_cache is None
+
+
+class TestMemberCache:
+    def test_layer_reloads_fitted_members(self, tmp_path):
+        X = np.array([[1, 1], [1, 2], [2, 2], [2, 3]])
+        y = np.dot(X, np.array([1, 2])) + 3
+        CountingRegression.n_fit = 0
+        first = Layer([CountingRegression(), CountingRegression()],
+                      [None, MinMaxScaler()], cache=str(tmp_path))
+        result = first.fit(X, y)
+        assert CountingRegression.n_fit == 2
+
+        second = Layer([CountingRegression(), CountingRegression()],
+                       [None, MinMaxScaler()], cache=str(tmp_path))
+        assert np.allclose(second.fit(X, y), result)
+        assert CountingRegression.n_fit == 2
+        assert np.allclose(second.predict(np.array([[3, 5]])), [[16, 16]])
+
+        # different parameters or data are fitted
+        Layer([CountingRegression(fit_intercept=False)],
+              cache=str(tmp_path)).fit(X, y)
+        assert CountingRegression.n_fit == 3
+        second.fit(X, y + 1)
+        assert CountingRegression.n_fit == 5
+
+    def test_least_recently_used_are_evicted(self, tmp_path):
+        X = np.array([[1, 1], [1, 2], [2, 2], [2, 3]])
+        y = np.dot(X, np.array([1, 2])) + 3
+        cache = MemberCache(str(tmp_path))
+        Layer([LinearRegression()], cache=cache).fit(X, y)
+        entry_size = cache.size()
+        cache.max_bytes = int(entry_size * 1.5)
+        Layer([LinearRegression()], cache=cache).fit(X, y + 1)
+        assert cache.size() == entry_size
+        cache.clear()
+        assert cache.size() == 0
+
+    def test_unpicklable_members_are_not_cached(self, tmp_path):
+        class HookedRegression(LinearRegression):
+            def fit(self, X, y):
+                self.hook_ = lambda: None
+                return super().fit(X, y)
+
+        X = np.array([[1, 1], [1, 2], [2, 2], [2, 3]])
+        y = np.dot(X, np.array([1, 2])) + 3
+        layer_model = Layer([HookedRegression()], cache=str(tmp_path))
+        with pytest.warns(UserWarning, match='could not be cached'):
+            layer_model.fit(X, y)
+        assert np.allclose(layer_model.predict(X), y.reshape(-1, 1))
+        assert os.listdir(str(tmp_path)) == []
+
+    def test_member_key_of_large_array_parameters(self, tmp_path):
+        from sklearn.preprocessing import FunctionTransformer
+        cache = MemberCache(str(tmp_path))
+        first, second = np.zeros(2001), np.zeros(2001)
+        second[1000] = 1
+        keys = [cache.member_key(FunctionTransformer(kw_args={'w': w}),
+                                 LinearRegression(), False, 'data')
+                for w in (first, second)]
+        assert keys[0] != keys[1]
+        assert cache.member_key(FunctionTransformer(lambda X: X),
+                                LinearRegression(), False, 'data') is None
+
+
+class TestRowPredictionCache:
+    def test_lru_and_ttl(self):
+        cache = RowPredictionCache(max_size=2)
+        keys = cache.keys(np.array([[1, 2], [3, 4], [5, 6]]))
+        cache.put_many(keys[:2], [1, 2])
+        assert cache.get_many(keys[:1]) == [1]
+        cache.put_many(keys[2:], [3])
+        # the second row was the least recently used
+        assert cache.get_many(keys) == [1, None, 3]
+        assert (cache.hits, cache.misses) == (3, 1)
+        cache = RowPredictionCache(ttl=0)
+        cache.put_many(keys, [1, 2, 3])
+        assert cache.get_many(keys) == [None, None, None]
+
+    def test_keys_of_large_integers(self):
+        cache = RowPredictionCache()
+        X = np.array([[2 ** 53, 1], [2 ** 53 + 1, 1]], dtype=np.int64)
+        first, second = cache.keys(X)
+        assert first != second
+        assert cache.keys(X.astype(np.float64))[0] != first
+
+    def test_stack_predicts_missing_rows_only(self):
+        X = np.array([[1, 2], [3, 4], [5, 7], [2, 1]])
+        y = np.array([1, 2, 3, 1])
+        cache = RowPredictionCache()
+        model = Stack([Layer([CountingRegression()])], row_cache=cache)
+        model.fit(X, y)
+        expected = model.predict(X)
+        assert (cache.hits, cache.misses) == (0, 4)
+        X_new = np.array([[3, 4], [0, 0], [3, 4], [0, 0]])
+        result = model.predict(X_new)
+        assert (cache.hits, cache.misses) == (2, 6)
+        assert model.report['n_samples'] == 1
+        assert np.allclose(result[[0, 2]], expected[1])
+        assert np.allclose(result, Stack([Layer([LinearRegression()])]).fit(
+            X, y).predict(X_new))
+        model.fit(X, y)
+        assert len(cache) == 0
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from sklearn.linear_model import LinearRegression, LogisticRegression
+from sklearn.preprocessing import MinMaxScaler
+from sklearn.model_selection import KFold
+from picknmix import Layer, Stack, LocalCluster
+from picknmix.distributed import DataRef
+
+
+def make_stack(**kwargs):
+    return Stack([Layer([LogisticRegression(solver='liblinear'),
+                         LinearRegression()],
+                        [MinMaxScaler(), MinMaxScaler()],
+                        proba=[True, False]),
+                  Layer([LogisticRegression(solver='liblinear')])],
+                 **kwargs)
+
+
+@pytest.fixture(scope='module')
+def cluster():
+    with LocalCluster(n_workers=2) as cluster:
+        yield cluster
+
+
+class TestLocalCluster:
+    def test_scatter_once(self, cluster):
+        X = np.arange(6).reshape(3, 2)
+        ref = cluster.scatter(X)
+        assert isinstance(ref, DataRef)
+        assert cluster.scatter(X) is ref
+        assert np.array_equal(cluster.submit(np.sum, ref).result(), 15)
+
+    def test_scatter_again_after_modification(self, cluster):
+        rng = np.random.RandomState(0)
+        X = rng.rand(20, 3)
+        y = X @ np.array([1., 2., 3.])
+        layer = Layer([LinearRegression()])
+        layer.fit(X, y, executor=cluster)
+        assert np.allclose(layer.models[0].coef_, [1, 2, 3])
+        X[:] = rng.rand(20, 3)
+        y[:] = X @ np.array([5., 5., 5.])
+        layer.fit(X, y, executor=cluster)
+        assert np.allclose(layer.models[0].coef_, [5, 5, 5])
+
+    @pytest.mark.parametrize('options', [{}, {'cv': 3},
+                                         {'cv': 3, 'refit': False},
+                                         {'folds': KFold(2)}])
+    def test_fit_stack_on_cluster(self, cluster, options):
+        rng = np.random.RandomState(0)
+        X = rng.rand(60, 3)
+        y = (X[:, 0] > 0.5).astype(int)
+        local = make_stack(**options).fit(X, y)
+        distributed = make_stack(**options).fit(X, y, executor=cluster)
+        assert np.allclose(distributed.predict(X), local.predict(X))
+        layer = distributed.layers[0]
+        assert layer.preprocessors[0] is layer.preprocessors[1]
@@ -0,0 +1,62 @@
+import json
+import numpy as np
+from sklearn.linear_model import LinearRegression
+from sklearn.linear_model import LogisticRegression
+from sklearn.preprocessing import MinMaxScaler
+from picknmix import Layer, Stack, JSONLinesLogger, ReportCollector
+
+
+class TestInstrument:
+    def test_layer_report(self):
+        collector = ReportCollector()
+        layer_model = Layer([LogisticRegression(solver='liblinear'),
+                             LinearRegression()], [MinMaxScaler(), None],
+                            proba=[True, False], callbacks=[collector])
+        X = np.array([[1, 1], [1, 2], [2, 2], [2, 3]])
+        y = np.array([1, 1, 0, 0])
+        layer_model.fit(X, y)
+        layer_model.predict(X[:3])
+        assert [report['method'] for report in collector.reports] == [
+            'fit', 'predict']
+        report = layer_model.report
+        assert report is collector.reports[-1]
+        assert report['n_samples'] == 3
+        assert report['output_shape'] == (3, 3)
+        first, second = report['members']
+        assert first['model'] == 'LogisticRegression'
+        assert first['preprocessor'] == 'MinMaxScaler'
+        assert first['output_shape'] == (3, 2)
+        assert second['nbytes'] == 3 * 8
+        assert first['preprocess_time'] >= 0
+        assert second['predict_time'] >= 0
+        assert 'fit_time' in collector.reports[0]['members'][0]
+
+    def test_stack_report_and_json_log(self, tmp_path):
+        path = str(tmp_path / 'log.jsonl')
+        model = Stack([Layer([LinearRegression(), LinearRegression()]),
+                       Layer([LinearRegression()])],
+                      callbacks=[JSONLinesLogger(path)])
+        X = np.array([[1, 1], [1, 2], [2, 2], [2, 3]])
+        y = np.dot(X, np.array([1, 2])) + 3
+        model.fit(X, y)
+        model.predict(X)
+        assert len(model.report['layers']) == 2
+        assert model.report['layers'][1]['output_shape'] == (4, 1)
+        with open(path) as f:
+            lines = [json.loads(line) for line in f]
+        assert [line['method'] for line in lines] == ['fit', 'predict']
+        assert lines[1]['layers'][0]['members'][1]['model'] == \
+            'LinearRegression'
+
+    def test_stack_shares_layer_callbacks(self):
+        collector = ReportCollector()
+        layer_model = Layer([LinearRegression()], callbacks=[collector])
+        model = Stack([layer_model, Layer([LinearRegression()])])
+        assert model.layers[0] is not layer_model
+        assert model.layers[0].callbacks[0] is collector
+        X = np.array([[1, 1], [1, 2], [2, 2], [2, 3]])
+        y = np.dot(X, np.array([1, 2])) + 3
+        model.fit(X, y)
+        model.predict(X)
+        assert [report['method'] for report in collector.reports] == [
+            'fit', 'predict']
@@ -6,6 +6,18 @@ from sklearn.linear_model import LogisticRegression
 from sklearn.exceptions import NotFittedError
 from picknmix import Layer
 
+
+def _shift(X, w):
+    return X + w[1000]
+
+
+class SlowRegression(LinearRegression):
+    def predict(self, X):
+        import time
+        time.sleep(0.05)
+        return super().predict(X)
+
+
 class TestLayer:
     def test_different_numbers_of_preprocessor_and_models(self):
         with pytest.raises(Exception):
@@ -167,4 +179,274 @@ class TestLayer:
         except(NotFittedError):
             gotError = True
 
-        assert gotError, "Model failed the copy Test: When copying, a deep copy was produced"
\ No newline at end of file
+        assert gotError, "Model failed the copy Test: When copying, a deep copy was produced"
+
+    @pytest.mark.parametrize("backend", ['threading', 'multiprocessing',
+                                         'joblib'])
+    def test_fit_predict_multiple_models_in_parallel(self, backend):
+        layer_model = Layer([LinearRegression(), LogisticRegression(),
+                             LinearRegression()],
+                            [None, None, MinMaxScaler()],
+                            proba=[False, True, False],
+                            n_jobs=2, backend=backend)
+        X = np.array([[1, 1], [1, 2], [2, 2], [2, 3]])
+        y = np.array([1, 1, 0, 0])
+        serial_model = Layer([LinearRegression(), LogisticRegression(),
+                              LinearRegression()],
+                             [None, None, MinMaxScaler()],
+                             proba=[False, True, False])
+        result = layer_model.fit(X, y)
+        assert result.shape == (4, 4)
+        assert np.allclose(result, serial_model.fit(X, y))
+        assert np.allclose(layer_model.predict(X), serial_model.predict(X))
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            Layer([LinearRegression()], backend='gpu')
+
+    def test_predict_with_persistent_pool(self):
+        layer_model = Layer([LinearRegression(), LinearRegression()],
+                            [None, MinMaxScaler()])
+        X = np.array([[1, 1], [1, 2], [2, 2], [2, 3]])
+        y = np.dot(X, np.array([1, 2])) + 3
+        layer_model.fit(X, y)
+        with layer_model.open_pool(2):
+            pool = layer_model._pool
+            for _ in range(3):
+                result = layer_model.predict(np.array([[3, 5]]))
+                assert np.allclose(result, np.array([[16, 16]]))
+            assert layer_model._pool is pool
+            # the pool is not copied with the Layer
+            assert layer_model.copy()._pool is None
+        assert layer_model._pool is None
+
+    def test_predict_with_process_pool(self):
+        from concurrent.futures import ProcessPoolExecutor
+        layer_model = Layer([LinearRegression(), LinearRegression(),
+                             LinearRegression()],
+                            [None, MinMaxScaler(), None])
+        X = np.array([[1, 1], [1, 2], [2, 2], [2, 3]])
+        y = np.dot(X, np.array([1, 2])) + 3
+        layer_model.fit(X, y)
+        expected = layer_model.predict(X)
+        with ProcessPoolExecutor(2) as pool:
+            layer_model.open_pool(pool=pool)
+            assert np.allclose(layer_model.predict(X), expected)
+            layer_model.close_pool()
+
+    def test_predict_into_preallocated_output(self):
+        layer_model = Layer([LogisticRegression(solver='liblinear'),
+                             LinearRegression()],
+                            proba=[True, False], dtype=np.float32)
+        X = np.array([[1, 1], [1, 2], [2, 2], [2, 3]])
+        y = np.array([1, 1, 0, 0])
+        result = layer_model.fit(X, y)
+        assert layer_model.output_widths == [2, 1]
+        assert result.dtype == np.float32
+        out = np.zeros((4, 3), dtype=np.float32)
+        returned = layer_model.predict(X, out=out)
+        assert returned is out
+        assert np.allclose(out, result)
+        with pytest.raises(ValueError):
+            layer_model.predict(X, out=np.zeros((4, 2)))
+
+    def test_fit_oof(self):
+        layer_model = Layer([LinearRegression(), LinearRegression()],
+                            [None, MinMaxScaler()], n_jobs=2)
+        X = np.array([[1, 1], [1, 2], [2, 2], [2, 3], [3, 1], [3, 4]])
+        y = np.dot(X, np.array([1, 2])) + 3
+        result = layer_model.fit_oof(X, y, cv=3)
+        assert result.shape == (6, 2)
+        assert np.allclose(result[:, 0], y)
+        assert layer_model.fold_layers is None
+        result = layer_model.predict(np.array([[3, 5]]))
+        assert np.allclose(result, np.array([[16, 16]]))
+
+    def test_fit_oof_without_refit(self):
+        layer_model = Layer([LinearRegression()])
+        X = np.array([[1, 1], [1, 2], [2, 2], [2, 3], [3, 1], [3, 4]])
+        y = np.dot(X, np.array([1, 2])) + 3
+        layer_model.fit_oof(X, y, cv=[([0, 1, 2], [3, 4, 5]),
+                                      ([3, 4, 5], [0, 1, 2])], refit=False)
+        assert len(layer_model.fold_layers) == 2
+        result = layer_model.predict(np.array([[3, 5]]))
+        assert np.allclose(result, np.array([[16]]))
+
+    def test_fit_oof_folds_must_cover_all_samples(self):
+        layer_model = Layer([LinearRegression()])
+        X = np.array([[1, 1], [1, 2], [2, 2], [2, 3]])
+        y = np.dot(X, np.array([1, 2])) + 3
+        with pytest.raises(ValueError):
+            layer_model.fit_oof(X, y, cv=[([0, 1], [2, 3])])
+
+    def test_take_rows_is_view_for_contiguous_rows(self):
+        from picknmix.picknmix import _take_rows
+        X = np.arange(12).reshape(6, 2)
+        assert np.shares_memory(_take_rows(X, [2, 3, 4]), X)
+        assert not np.shares_memory(_take_rows(X, [0, 2, 4]), X)
+        assert np.array_equal(_take_rows(X, [0, 2, 4]), X[[0, 2, 4]])
+
+    def test_equivalent_preprocessors_are_shared(self):
+        class CountingScaler(MinMaxScaler):
+            n_fit = 0
+            n_transform = 0
+
+            def fit(self, X, y=None):
+                CountingScaler.n_fit += 1
+                return super().fit(X, y)
+
+            def transform(self, X):
+                CountingScaler.n_transform += 1
+                return super().transform(X)
+
+        layer_model = Layer([LinearRegression(), LinearRegression(),
+                             LinearRegression(), LinearRegression()],
+                            [CountingScaler(), CountingScaler(), None,
+                             CountingScaler(feature_range=(-1, 1))])
+        X = np.array([[1, 1], [1, 2], [2, 2], [2, 3]])
+        y = np.dot(X, np.array([1, 2])) + 3
+        layer_model.fit(X, y)
+        assert CountingScaler.n_fit == 2
+        assert layer_model.preprocessors[0] is layer_model.preprocessors[1]
+        assert layer_model.preprocessors[0] is not layer_model.preprocessors[3]
+        CountingScaler.n_transform = 0
+        result = layer_model.predict(np.array([[3, 5]]))
+        assert CountingScaler.n_transform == 2
+        assert np.allclose(result, np.array([[16, 16, 16, 16]]))
+
+    def test_proba_fallback_is_decided_once_in_fit(self):
+        import warnings
+        layer_model = Layer([LinearRegression(), LogisticRegression()],
+                            proba=True)
+        X = np.array([[1, 1], [1, 2], [2, 2], [2, 3]])
+        y = np.array([1, 1, 0, 0])
+        with pytest.warns(Warning) as record:
+            layer_model.fit(X, y)
+        assert len([r for r in record if 'predict_proba' in str(r.message)]) == 1
+        assert layer_model.predict_methods == ['predict', 'predict_proba']
+        assert layer_model.proba_fallbacks == [0]
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            assert layer_model.predict(X).shape == (4, 3)
+
+    def test_preprocessors_with_different_arrays_are_not_shared(self):
+        from sklearn.preprocessing import FunctionTransformer
+        X = np.array([[1, 2], [3, 4], [5, 7], [2, 1]])
+        y = np.array([1, 2, 3, 1])
+        first, second = np.zeros(2001), np.zeros(2001)
+        second[1000] = 10
+        layer_model = Layer([LinearRegression(), LinearRegression(),
+                             LinearRegression()],
+                            [FunctionTransformer(_shift, kw_args={'w': first}),
+                             FunctionTransformer(_shift, kw_args={'w': second}),
+                             FunctionTransformer(lambda X: X + 10)])
+        layer_model.fit(X, y)
+        assert len({id(preprocessor) for preprocessor
+                    in layer_model.preprocessors}) == 3
+        preprocessors = layer_model.preprocessors
+        assert np.allclose(preprocessors[0].transform(X), X)
+        assert np.allclose(preprocessors[1].transform(X), X + 10)
+        assert np.allclose(preprocessors[2].transform(X), X + 10)
+
+    def test_shared_members_are_cloned_before_fitting(self):
+        X = np.array([[1, 2], [3, 4], [5, 7]])
+        y = np.array([1, 2, 3])
+        model = LinearRegression()
+        layer_model = Layer([model], ownership='share')
+        assert layer_model.models[0] is model
+        layer_model.fit(X, y)
+        assert layer_model.models[0] is not model
+        assert not hasattr(model, 'coef_')
+
+    def test_copy_fitted_shares_members(self):
+        X = np.array([[1, 2], [3, 4], [5, 7]])
+        y = np.array([1, 2, 3])
+        layer_model = Layer([LinearRegression()], [MinMaxScaler()],
+                            ownership='clone')
+        layer_model.fit(X, y)
+        copied = layer_model.copy(fitted=True)
+        assert copied.models[0] is layer_model.models[0]
+        assert np.array_equal(copied.predict(X), layer_model.predict(X))
+        copied.fit(X, y + 1)
+        assert copied.models[0] is not layer_model.models[0]
+        assert np.allclose(layer_model.predict(X), y.reshape(-1, 1))
+
+    def test_unknown_ownership(self):
+        with pytest.raises(ValueError):
+            Layer([LinearRegression()], ownership='steal')
+
+    def test_apredict_same_as_predict(self):
+        import asyncio
+        X = np.array([[1, 2], [3, 4], [5, 7], [2, 1]])
+        y = np.array([0, 1, 1, 0])
+        layer_model = Layer([LogisticRegression(solver='liblinear'),
+                             LinearRegression()],
+                            [MinMaxScaler(), None], proba=[True, False])
+        layer_model.fit(X, y)
+        result = asyncio.run(layer_model.apredict(X))
+        assert np.array_equal(result, layer_model.predict(X))
+        assert len(layer_model.report['members']) == 2
+
+    def test_apredict_with_process_executor(self):
+        import asyncio
+        from concurrent.futures import ProcessPoolExecutor
+        X = np.array([[1, 2], [3, 4], [5, 7], [2, 1]])
+        y = np.array([0, 1, 1, 0])
+        layer_model = Layer([LogisticRegression(solver='liblinear'),
+                             LinearRegression(), LinearRegression()],
+                            [MinMaxScaler(), None, None],
+                            proba=[True, False, False])
+        layer_model.fit(X, y)
+        with ProcessPoolExecutor(2) as executor:
+            result = asyncio.run(layer_model.apredict(X, executor=executor))
+        assert np.allclose(result, layer_model.predict(X))
+
+    def test_concurrent_apredict_with_unknown_layout(self):
+        import asyncio
+        X = np.array([[1, 2], [3, 4], [5, 7], [2, 1]])
+        y = np.array([1, 2, 3, 1])
+        layer_model = Layer([SlowRegression().fit(X, y),
+                             SlowRegression().fit(X, y)],
+                            ownership='share')
+        assert layer_model.output_widths is None
+
+        async def predict_all():
+            return await asyncio.wait_for(asyncio.gather(*[
+                layer_model.apredict(X) for _ in range(8)]), 10)
+
+        with layer_model.open_pool(n_jobs=2):
+            results = asyncio.run(predict_all())
+        expected = layer_model.predict(X)
+        assert expected.shape == (4, 2)
+        for result in results:
+            assert np.array_equal(result, expected)
+
+    def test_partial_fit_incremental_and_buffered_members(self):
+        from sklearn.linear_model import SGDClassifier
+        from sklearn.preprocessing import StandardScaler
+        rng = np.random.RandomState(0)
+        X = rng.rand(60, 2)
+        y = (X[:, 0] > 0.5).astype(int)
+        layer_model = Layer([SGDClassifier(loss='log_loss', random_state=0),
+                             LogisticRegression(solver='liblinear')],
+                            [StandardScaler(), None], proba=True)
+        for start in range(0, 60, 20):
+            result = layer_model.partial_fit(X[start:start + 20],
+                                             y[start:start + 20],
+                                             classes=[0, 1], buffer_size=40)
+            assert result.shape == (20, 4)
+        # the scaler learnt from every batch, the buffer kept the last 40 rows
+        assert layer_model.preprocessors[0].n_samples_seen_ == 60
+        assert layer_model._partial_buffer[0].shape == (40, 2)
+        assert layer_model.report['method'] == 'partial_fit'
+        assert layer_model.predict(X).shape == (60, 4)
+
+    def test_partial_fit_buffer_smaller_than_batch(self):
+        X = np.random.RandomState(0).rand(50, 2)
+        y = X.sum(axis=1)
+        layer_model = Layer([LinearRegression()])
+        result = layer_model.partial_fit(X, y, buffer_size=10)
+        assert result.shape == (50, 1)
+        assert layer_model._partial_buffer[0].shape == (50, 2)
+        layer_model.partial_fit(X[:5], y[:5], buffer_size=10)
+        assert layer_model._partial_buffer[0].shape == (10, 2)
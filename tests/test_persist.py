@@ -0,0 +1,101 @@
+import json
+import os
+import pytest
+import numpy as np
+from sklearn.linear_model import LinearRegression, LogisticRegression
+from sklearn.preprocessing import MinMaxScaler
+from picknmix import Layer, Stack
+from picknmix import persist
+
+
+class TestPersist:
+    def test_save_load_stack(self, tmp_path):
+        X = np.array([[1, 2], [3, 4], [5, 7], [2, 1], [6, 3], [4, 4]])
+        y = np.array([0, 1, 1, 0, 1, 0])
+        model = Stack([Layer([LogisticRegression(solver='liblinear'),
+                              LinearRegression()],
+                             [MinMaxScaler(), MinMaxScaler()],
+                             proba=[True, False]),
+                       Layer([LogisticRegression(solver='liblinear')])])
+        model.fit(X, y)
+        path = str(tmp_path / 'model')
+        model.save(path)
+        # the equivalent preprocessors are shared, and saved once
+        assert sorted(os.listdir(os.path.join(path, 'layer0'))) == [
+            'model0.pkl', 'model1.pkl', 'preprocessor0.pkl']
+        loaded = Stack.load(path)
+        assert np.array_equal(loaded.predict(X), model.predict(X))
+        assert (loaded.layers[0].preprocessors[0] is
+                loaded.layers[0].preprocessors[1])
+        # saving again replaces the model
+        model.save(path)
+        assert np.array_equal(Stack.load(path).predict(X), model.predict(X))
+
+    def test_callbacks_are_not_saved(self, tmp_path):
+        X = np.array([[1, 2], [3, 4], [5, 7], [2, 1]])
+        y = np.array([1, 2, 3, 1])
+        reports = []
+        model = Stack([Layer([LinearRegression()],
+                             callbacks=[lambda report: None]),
+                       Layer([LinearRegression()])],
+                      callbacks=[reports.append])
+        model.fit(X, y)
+        path = str(tmp_path / 'model')
+        model.save(path)
+        loaded = Stack.load(path)
+        assert loaded.callbacks == [] and loaded.layers[0].callbacks == []
+        assert np.allclose(loaded.predict(X), model.predict(X))
+        assert len(model.layers[0].callbacks) == 1
+        assert len(reports) == 2
+
+    def test_large_arrays_are_memory_mapped(self, tmp_path):
+        X = np.random.RandomState(0).rand(10, 20000)
+        y = X[:, 0]
+        layer_model = Layer([LinearRegression()])
+        layer_model.fit(X, y)
+        path = str(tmp_path / 'layer')
+        layer_model.save(path)
+        assert os.path.exists(os.path.join(path, 'layer0', 'model0.0.bin'))
+        loaded = Layer.load(path)
+        assert not loaded.models[0].coef_.flags.writeable
+        assert np.allclose(loaded.predict(X), layer_model.predict(X))
+        loaded = Layer.load(path, mmap_mode=None)
+        assert loaded.models[0].coef_.flags.writeable
+
+    def test_load_checks_format_and_class(self, tmp_path):
+        layer_model = Layer([LinearRegression()])
+        layer_model.fit(np.array([[1], [2]]), np.array([1, 2]))
+        path = str(tmp_path / 'layer')
+        layer_model.save(path)
+        with pytest.raises(TypeError):
+            Stack.load(path)
+        manifest_path = os.path.join(path, persist.MANIFEST)
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        manifest['format_version'] = persist.FORMAT_VERSION + 1
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f)
+        with pytest.raises(ValueError):
+            Layer.load(path)
+
+    def test_save_does_not_replace_other_directories(self, tmp_path):
+        layer_model = Layer([LinearRegression()])
+        with pytest.raises(FileExistsError):
+            layer_model.save(str(tmp_path))
+
+    def test_lazy_load_on_first_use(self, tmp_path):
+        X = np.array([[1, 2], [3, 4], [5, 7], [2, 1], [6, 3], [4, 4]])
+        y = np.array([0, 1, 1, 0, 1, 0])
+        model = Stack([Layer([LogisticRegression(solver='liblinear')],
+                             [MinMaxScaler()], proba=True),
+                       Layer([LogisticRegression(solver='liblinear')])])
+        model.fit(X, y)
+        path = str(tmp_path / 'model')
+        model.save(path)
+        loaded = Stack.load(path, lazy=True)
+        assert isinstance(loaded.layers[1].models[0], persist.LazyMember)
+        loaded.warm_up(layers=[0])
+        assert isinstance(loaded.layers[0].models[0], LogisticRegression)
+        assert isinstance(loaded.layers[1].models[0], persist.LazyMember)
+        assert np.array_equal(loaded.predict(X), model.predict(X))
+        assert isinstance(loaded.layers[1].models[0], LogisticRegression)
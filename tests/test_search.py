@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from sklearn.linear_model import LinearRegression, Ridge
+from sklearn.preprocessing import MinMaxScaler
+from sklearn.model_selection import KFold
+from picknmix import Layer, Stack, StackSearch
+
+
+class CountingRegression(LinearRegression):
+    n_fit = 0
+
+    def fit(self, X, y):
+        CountingRegression.n_fit += 1
+        return super().fit(X, y)
+
+
+def make_data():
+    rng = np.random.RandomState(0)
+    X = rng.rand(80, 3)
+    y = X @ np.array([1.0, 2.0, -1.0]) + 0.1 * rng.rand(80)
+    return X[:60], y[:60], X[60:], y[60:]
+
+
+class TestStackSearch:
+    @pytest.mark.parametrize('stack_params', [{}, {'cv': 3},
+                                              {'folds': KFold(2)},
+                                              {'passthrough': True}])
+    def test_prefix_is_fitted_once(self, stack_params):
+        X, y, X_valid, y_valid = make_data()
+        CountingRegression.n_fit = 0
+        search = StackSearch(
+            [Layer([CountingRegression(), CountingRegression()],
+                   [None, MinMaxScaler()]),
+             [Layer([Ridge(alpha=alpha)]) for alpha in (0.01, 0.1, 1, 10)]],
+            stack_params=stack_params, n_jobs=2)
+        search.fit(X, y, X_valid, y_valid)
+        n_folds = stack_params.get('cv', 0)
+        assert CountingRegression.n_fit == 2 * (n_folds + 1)
+        assert search.n_prefix_fits_ == 1
+        assert len(search.results_) == 4
+        best_alpha = (0.01, 0.1, 1, 10)[search.best_index_]
+        expected = Stack([Layer([LinearRegression(), LinearRegression()],
+                                [None, MinMaxScaler()]),
+                          Layer([Ridge(alpha=best_alpha)])], **stack_params)
+        expected.fit(X, y)
+        assert np.allclose(search.predict(X_valid), expected.predict(X_valid))
+
+    def test_shared_first_layers_and_random_candidates(self):
+        X, y, X_valid, y_valid = make_data()
+        CountingRegression.n_fit = 0
+        search = StackSearch(
+            [Layer([CountingRegression()]),
+             [Layer([LinearRegression()]), Layer([Ridge()])],
+             [Layer([Ridge(alpha=alpha)]) for alpha in (0.1, 1, 10)]],
+            n_iter=4, random_state=0)
+        search.fit(X, y, X_valid, y_valid)
+        assert len(set(search.candidates())) == 4
+        # the first Layer is shared by all the prefixes
+        assert CountingRegression.n_fit == 1
+        assert search.best_score_ == max(result['score']
+                                         for result in search.results_)
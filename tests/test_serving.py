@@ -0,0 +1,47 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import numpy as np
+from sklearn.linear_model import LinearRegression
+from picknmix import Layer, Stack, MicroBatcher
+
+
+class TestMicroBatcher:
+    def test_requests_are_batched_and_scattered(self):
+        X = np.random.RandomState(0).rand(40, 3)
+        y = X.sum(axis=1)
+        model = Stack([Layer([LinearRegression(), LinearRegression()]),
+                       Layer([LinearRegression()])])
+        model.fit(X, y)
+        with MicroBatcher(model, max_batch_size=16, max_wait=0.05) as batcher:
+            with ThreadPoolExecutor(8) as executor:
+                results = list(executor.map(
+                    lambda idx: batcher.predict(X[idx:idx + 1]), range(40)))
+        assert np.allclose(np.concatenate(results), model.predict(X))
+        assert batcher.n_requests == 40
+        assert batcher.n_batches < 40
+
+    def test_apredict(self):
+        X = np.array([[1, 2], [3, 4], [5, 7]])
+        y = np.array([1, 2, 3])
+        model = Stack([Layer([LinearRegression()])])
+        model.fit(X, y)
+
+        async def predict_rows(batcher):
+            return await asyncio.gather(*[batcher.apredict(X[idx:idx + 1])
+                                          for idx in range(3)])
+
+        with MicroBatcher(model) as batcher:
+            results = asyncio.run(predict_rows(batcher))
+        assert np.allclose(np.concatenate(results), model.predict(X))
+
+    def test_errors_are_passed_to_callers(self):
+        X = np.array([[1, 2], [3, 4], [5, 7]])
+        layer_model = Layer([LinearRegression()])
+        layer_model.fit(X, np.array([1, 2, 3]))
+        with MicroBatcher(layer_model) as batcher:
+            # wrong number of features
+            with pytest.raises(ValueError):
+                batcher.predict(np.ones((1, 3)))
+        with pytest.raises(RuntimeError):
+            batcher.submit(X[:1])
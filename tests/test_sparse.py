@@ -0,0 +1,53 @@
+import numpy as np
+import scipy.sparse as sp
+from sklearn.linear_model import Ridge
+from sklearn.preprocessing import MaxAbsScaler
+from picknmix import Layer, Stack
+
+
+def make_data():
+    X = sp.random(20, 5, density=0.4, format='coo', random_state=0)
+    y = np.asarray(X @ np.arange(1, 6)).ravel() + 3
+    return X, y
+
+
+class TestSparse:
+    def test_layer_with_sparse_input(self):
+        X, y = make_data()
+        layer_model = Layer([Ridge(), Ridge()], [MaxAbsScaler(), None])
+        assert layer_model.fit(X, y).shape == (20, 2)
+        assert layer_model.fit_oof(X, y, cv=4).shape == (20, 2)
+        assert layer_model.predict(X.tocsr()[:3]).shape == (3, 2)
+
+    def test_passthrough_keeps_sparse_features(self):
+        X, y = make_data()
+        layer_model = Layer([Ridge(), Ridge()], [MaxAbsScaler(), None],
+                            passthrough=True)
+        result = layer_model.fit(X, y)
+        assert sp.issparse(result) and result.format == 'csr'
+        assert result.shape == (20, 7)
+        assert np.allclose(result[:, :5].toarray(), X.toarray())
+        assert layer_model.n_outputs == 7
+        result = layer_model.predict(X.tocsr()[:3])
+        assert sp.issparse(result) and result.shape == (3, 7)
+
+    def test_passthrough_dense_features(self):
+        X, y = make_data()
+        X = X.toarray()
+        layer_model = Layer([Ridge()], passthrough=True)
+        result = layer_model.fit(X, y)
+        assert result.shape == (20, 6)
+        assert np.array_equal(result[:, :5], X)
+        out = np.empty((2, 6))
+        assert layer_model.predict(X[:2], out=out) is out
+
+    def test_stack_with_sparse_folds(self):
+        X, y = make_data()
+        model = Stack([Layer([Ridge(), Ridge()], [MaxAbsScaler(), None],
+                             passthrough=True),
+                       Layer([Ridge()])],
+                      folds=[list(range(10)), list(range(10, 20))])
+        model.fit(X, y)
+        assert model.predict(X.tocsr()[:4]).shape == (4,)
+        assert np.allclose(model.compile().predict(X), model.predict(X))
+        assert model.predict_chunked(X, chunk_size=6).shape == (20,)
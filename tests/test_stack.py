@@ -130,4 +130,249 @@ class TestStack:
         except(NotFittedError):
             gotError = True
 
-        assert gotError, "Model failed the copy Test: When copying, a deep copy was produced"
\ No newline at end of file
+        assert gotError, "Model failed the copy Test: When copying, a deep copy was produced"
+
+    def test_n_jobs_and_backend_passed_to_layers(self):
+        model = Stack([layer_width2_reg, layer_width1_reg], n_jobs=2,
+                      backend='multiprocessing')
+        assert all(layer.n_jobs == 2 for layer in model.layers)
+        assert all(layer.backend == 'multiprocessing'
+                   for layer in model.layers)
+        X = np.array([[1, 1], [1, 2], [2, 2], [2, 3]])
+        y = np.dot(X, np.array([1, 2])) + 3
+        model.fit(X, y)
+        result = model.predict(np.array([[3, 5],[3, 5]]))
+        assert np.allclose(result, np.array([16, 16]))
+        assert model.copy().layers[0].n_jobs == 2
+
+    def test_predict_with_persistent_pool(self):
+        model = Stack([layer_width2_reg, layer_width1_reg])
+        X = np.array([[1, 1], [1, 2], [2, 2], [2, 3]])
+        y = np.dot(X, np.array([1, 2])) + 3
+        model.fit(X, y)
+        with model.open_pool():
+            assert all(layer._pool is model._pool for layer in model.layers)
+            result = model.predict(np.array([[3, 5],[3, 5]]))
+            assert np.allclose(result, np.array([16, 16]))
+        assert all(layer._pool is None for layer in model.layers)
+
+    def test_predict_into_preallocated_output(self):
+        model = Stack([layer_width2_reg, layer_width1_reg], dtype=np.float32)
+        X = np.array([[1, 1], [1, 2], [2, 2], [2, 3]])
+        y = np.dot(X, np.array([1, 2])) + 3
+        model.fit(X, y)
+        out = np.zeros(2, dtype=np.float32)
+        model.predict(np.array([[3, 5],[3, 5]]), out=out)
+        assert np.allclose(out, np.array([16, 16]), atol=1e-3)
+
+    def test_dtype_keeps_final_predictions(self):
+        X = np.array([[1, 2], [3, 4], [5, 7], [2, 1], [6, 3], [4, 4]])
+        y = np.array(['no', 'yes', 'yes', 'no', 'yes', 'no'])
+        model = Stack([Layer([LogisticRegression(solver='liblinear')],
+                             proba=True),
+                       Layer([LogisticRegression(solver='liblinear')])],
+                      dtype=np.float32)
+        model.fit(X, y)
+        assert model.layers[0].output_dtype == np.float32
+        assert set(model.predict(X)) <= {'no', 'yes'}
+
+    def test_fit_predict_stack_with_oof(self):
+        model = Stack([layer_width2_reg, layer_width1_reg], cv=KFold(2))
+        X = np.array([[1, 1], [1, 2], [2, 2], [2, 3],
+                      [3, 1], [3, 2], [1, 3], [2, 4]])
+        y = np.dot(X, np.array([1, 2])) + 3
+        model.fit(X, y)
+        result = model.predict(np.array([[3, 5],[3, 5]]))
+        assert result.shape == (2,)
+        assert np.allclose(result, np.array([16, 16]))
+
+    def test_initialize_stack_with_folds_and_cv(self):
+        with pytest.raises(AssertionError):
+            Stack([layer_width2_reg, layer_width1_reg], folds=KFold(2),
+                  cv=3)
+
+    def test_predict_chunked_and_iter(self, tmp_path):
+        model = Stack([layer_width2_reg, layer_width1_reg])
+        X = np.array([[1, 1], [1, 2], [2, 2], [2, 3]])
+        y = np.dot(X, np.array([1, 2])) + 3
+        model.fit(X, y)
+
+        X_disk = np.memmap(tmp_path / 'X.dat', dtype=np.float64, mode='w+',
+                           shape=(5, 2))
+        X_disk[:] = np.array([[3, 5]] * 5)
+        out = np.memmap(tmp_path / 'out.dat', dtype=np.float64, mode='w+',
+                        shape=(5,))
+        result = model.predict_chunked(X_disk, chunk_size=2, out=out)
+        assert result is out
+        assert np.allclose(out, 16)
+        assert np.allclose(model.predict_chunked(X_disk, chunk_size=3), 16)
+
+        chunks = list(model.predict_iter(X_disk, chunk_size=2))
+        assert [chunk.shape for chunk in chunks] == [(2,), (2,), (1,)]
+        batches = (np.array([[3, 5]] * n) for n in (1, 3))
+        chunks = list(model.predict_iter(batches))
+        assert [chunk.shape for chunk in chunks] == [(1,), (3,)]
+
+    def test_fit_stack_with_folds_on_memmap(self, tmp_path):
+        X = np.array([[1, 1], [1, 2], [2, 2], [2, 3],
+                      [3, 1], [3, 2], [1, 3], [2, 4],
+                      [1, 1], [1, 2], [2, 2], [2, 3]], dtype=np.float64)
+        y = np.dot(X, np.array([1, 2])) + 3
+        np.save(tmp_path / 'X.npy', X)
+        np.save(tmp_path / 'y.npy', y)
+        model = Stack([layer_width2_reg, layer_width1_reg,
+                       Layer([LinearRegression()])], folds=KFold(3))
+        model.fit(str(tmp_path / 'X.npy'), str(tmp_path / 'y.npy'))
+        assert [list(fold) for fold in model.folds] == [
+            [0, 1, 2, 3], [4, 5, 6, 7], [8, 9, 10, 11]]
+        result = model.predict(np.array([[3, 5],[3, 5]]))
+        assert np.allclose(result, np.array([16, 16]))
+
+    @pytest.mark.parametrize("folds", [None, [[0, 1, 2], [3, 4, 5],
+                                              [6, 7, 8], [9, 10, 11]]])
+    def test_fit_predict_stack_with_passthrough(self, folds):
+        from sklearn.neighbors import KNeighborsRegressor
+        rng = np.random.RandomState(0)
+        X = rng.rand(12, 3)
+        y = np.dot(X, np.array([1, 2, 3])) + 3
+        layers = [Layer([LinearRegression(), LinearRegression()]),
+                  Layer([KNeighborsRegressor(n_neighbors=2)]),
+                  Layer([LinearRegression()], [MinMaxScaler()]),
+                  Layer([LinearRegression()])]
+        model = Stack(layers, folds=folds, passthrough=True)
+        model.fit(X, y)
+        assert model.layers[1].models[0].n_features_in_ == 5
+        assert model.layers[3].models[0].n_features_in_ == 4
+
+        # same as concatenating the features by hand, on alternating sides
+        X_new = model.layers[0].predict(X)
+        for idx in range(1, 4):
+            blocks = [X, X_new] if idx % 2 else [X_new, X]
+            X_new = model.layers[idx].predict(np.hstack(blocks))
+        assert np.allclose(model.predict(X), X_new.flatten())
+
+    def test_compiled_stack_predicts_the_same(self):
+        from sklearn.neighbors import KNeighborsRegressor
+        rng = np.random.RandomState(0)
+        X = rng.rand(12, 3)
+        y = (np.dot(X, np.array([1, 2, 3])) > 3).astype(int)
+        layers = [Layer([LogisticRegression(), LinearRegression(),
+                         LinearRegression()],
+                        [MinMaxScaler(), MinMaxScaler(), None],
+                        proba=[True, False, False], passthrough=True),
+                  Layer([KNeighborsRegressor(n_neighbors=2)]),
+                  Layer([LogisticRegression()], [MinMaxScaler()])]
+        for passthrough in (False, True):
+            model = Stack(layers, passthrough=passthrough)
+            model.fit(X, y)
+            compiled = model.compile()
+            assert np.array_equal(compiled.predict(X), model.predict(X))
+            assert np.array_equal(compiled.predict(X[:1]),
+                                  model.predict(X[:1]))
+
+    def test_compile_unfitted_stack(self):
+        with pytest.raises(ValueError):
+            Stack([Layer([LinearRegression()])]).compile()
+
+    def test_stack_copy_fitted_shares_layers_models(self):
+        X = np.array([[1, 2], [3, 4], [5, 7], [2, 1]])
+        y = np.array([1, 2, 3, 1])
+        model = Stack([Layer([LinearRegression()]),
+                       Layer([LinearRegression()])], ownership='clone')
+        model.fit(X, y)
+        copied = model.copy(fitted=True)
+        assert copied.layers[0].models[0] is model.layers[0].models[0]
+        assert np.array_equal(copied.predict(X), model.predict(X))
+        unfitted = model.copy()
+        with pytest.raises(NotFittedError):
+            unfitted.predict(X)
+
+    @pytest.mark.parametrize('passthrough', [False, True])
+    def test_apredict_same_as_predict(self, passthrough):
+        import asyncio
+        X = np.array([[1, 2], [3, 4], [5, 7], [2, 1], [6, 3], [4, 4]])
+        y = np.array([0, 1, 1, 0, 1, 0])
+        model = Stack([Layer([LogisticRegression(solver='liblinear'),
+                              LinearRegression()], proba=[True, False]),
+                       Layer([LinearRegression(), LinearRegression()]),
+                       Layer([LinearRegression()])],
+                      passthrough=passthrough)
+        model.fit(X, y)
+
+        async def predict_concurrently():
+            return await asyncio.gather(model.apredict(X[:3]),
+                                        model.apredict(X[3:]))
+
+        results = asyncio.run(predict_concurrently())
+        assert np.allclose(np.concatenate(results), model.predict(X))
+
+    @pytest.mark.parametrize('passthrough', [False, True])
+    def test_partial_fit_stack(self, passthrough):
+        from sklearn.linear_model import SGDClassifier
+        rng = np.random.RandomState(0)
+        X = rng.rand(60, 2)
+        y = (X[:, 0] > 0.5).astype(int)
+        model = Stack([Layer([SGDClassifier(loss='log_loss', random_state=0),
+                              LogisticRegression(solver='liblinear')],
+                             proba=True),
+                       Layer([SGDClassifier(random_state=0)])],
+                      passthrough=passthrough)
+        for start in range(0, 60, 20):
+            model.partial_fit(X[start:start + 20], y[start:start + 20],
+                              classes=[0, 1])
+        assert model.report['method'] == 'partial_fit'
+        assert set(model.predict(X)) <= {0, 1}
+
+    @pytest.mark.parametrize('passthrough', [False, True])
+    def test_predict_cascade(self, passthrough):
+        from picknmix.cascade import ProbaThreshold
+        rng = np.random.RandomState(0)
+        X = rng.rand(100, 2)
+        y = (X[:, 0] + 0.3 * rng.rand(100) > 0.6).astype(int)
+        model = Stack([Layer([LogisticRegression(solver='liblinear')],
+                             proba=True),
+                       Layer([LogisticRegression(solver='liblinear')])],
+                      passthrough=passthrough)
+        model.fit(X, y)
+        full = model.predict(X)
+        assert np.array_equal(model.predict_cascade(X, [ProbaThreshold(1.1)]),
+                              full)
+        assert model.report['exit_rates'] == [0.0, 1.0]
+
+        result = model.predict_cascade(X, [ProbaThreshold(0.7)])
+        proba = model.layers[0].predict(X)[:, -2:]
+        confident = proba.max(axis=1) >= 0.7
+        assert 0 < confident.sum() < 100
+        assert np.array_equal(result[confident],
+                              proba[confident].argmax(axis=1))
+        assert np.array_equal(result[~confident], full[~confident])
+        assert model.report['exit_rates'] == [confident.mean(),
+                                              1 - confident.mean()]
+        with pytest.raises(ValueError):
+            model.predict_cascade(X, [])
+        model = Stack([Layer([LogisticRegression(solver='liblinear')],
+                             proba=True),
+                       Layer([LogisticRegression(solver='liblinear')],
+                             proba=True)],
+                      passthrough=passthrough)
+        model.fit(X, y)
+        with pytest.raises(ValueError, match='last Layer'):
+            model.predict_cascade(X, [ProbaThreshold(0.7)])
+
+    @pytest.mark.parametrize('passthrough', [False, True])
+    def test_share_prefitted_models(self, passthrough):
+        X = np.array([[1, 2], [3, 4], [5, 7], [2, 1], [6, 3], [4, 4]])
+        y = np.array([0, 1, 1, 0, 1, 0])
+        first = LogisticRegression(solver='liblinear').fit(X, y)
+        X_meta = first.predict_proba(X)
+        if passthrough:
+            X_meta = np.hstack([X, X_meta])
+        second = LinearRegression().fit(X_meta, y)
+        model = Stack([Layer([first], proba=True, ownership='share'),
+                       Layer([second], ownership='share')],
+                      ownership='share', passthrough=passthrough)
+        assert model.layers[0].models[0] is first
+        assert np.allclose(model.predict(X), second.predict(X_meta))
+        # the layout is known after the first predict
+        assert model.layers[0].output_widths == [2]
+        assert np.allclose(model.predict(X), second.predict(X_meta))